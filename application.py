@@ -1,29 +1,178 @@
+from __future__ import annotations
+
+import functools
 import os
+import sys
+from typing import Callable, Iterator, TextIO
+
 import click
-from jisho_api.sentence import Sentence
-from jisho_api.tokenize import Tokens
-from jisho_api.word import Word
-from jisho_api.word.cfg import WordConfig
 
-from configuration import Config, Examples, Library
-from formatting import word_to_csv, csv_header, word_japanese
+import profiling
+from caching import ResponseCache, text_key
+from cards import Card
+from configuration import BatchProgress, Config, Examples, Library, card_key
+from formatting import FORMATS, card_columns, column_writer, csv_header, data_renderer, open_output, split_path, \
+    word_japanese
+from requesting import Fetcher, Result, DEFAULT_WORKERS, DEFAULT_RATE, request_sentences, request_tokens, request_word, \
+    split_words
+from tokenizing import TOKENIZERS, DictionaryTokenizer, Tokenizer, split_text
+
+# jisho_api pulls in requests, pydantic, bs4 and rich, so it's only imported by the commands that go online.
+# this keeps local commands like `library view` and `config view` quick to start
+
+
+def word_request(fetcher: Fetcher, cache: ResponseCache):
+    """Word lookup through the response cache, rate limited by the fetcher when going online."""
+    from jisho_api.word.request import WordRequest
+    return cache.wrap('word', fetcher.limited(request_word), WordRequest)
+
+
+def jisho_tokenizer(fetcher: Fetcher, cache: ResponseCache) -> Tokenizer:
+    """Tokenizing on jisho.org, through the response cache (keyed by a hash of the text), rate limited by the fetcher."""
+    from jisho_api.tokenize.request import TokenRequest
+    request = cache.wrap('tokens', fetcher.limited(request_tokens), TokenRequest, key=text_key)
+
+    def tokenize(text: str) -> list[str] | None:
+        response = request(text)
+        return [tk.token for tk in response.data] if response is not None else None
+    return tokenize
+
+
+def text_tokenizer(backend: str, fetcher: Fetcher, cache: ResponseCache) -> Callable[[list[str]], list[list[str]]]:
+    """
+    Returns a function which tokenizes a list of texts with the chosen backend ('jisho' or 'local').
+    jisho.org tokenizes the texts concurrently; any it can't (e.g. offline, if they aren't cached)
+    are tokenized locally instead, with the written forms and readings of the cards in the library.
+    """
+    local: Tokenizer | None = None
+
+    def tokenize_locally(text: str) -> list[str]:
+        nonlocal local
+        if local is None:
+            local = DictionaryTokenizer(Library.forms())
+        return local(text) or []
 
+    if backend == 'local':
+        return lambda texts: [tokenize_locally(t) for t in texts]
 
-def gen_words(words: list[str]):
-    """Get and cache info on each word in the provided list of words."""
-    got = list(w.data[0] for w in filter(lambda x: x is not None, [Word.request(w) for w in words]))
-    click.echo(f'Found {', '.join([c.slug for c in got])}')
+    tokenize = jisho_tokenizer(fetcher, cache)
 
+    def tokenize_all(texts: list[str]) -> list[list[str]]:
+        tokens = []
+        for r in fetcher.map(tokenize, texts):
+            if r.error is not None:
+                click.echo(f'Couldn\'t tokenize "{r.query[:20]}..." on jisho.org ({r.error}), so splitting it locally.')
+                tokens.append(tokenize_locally(r.query))
+            else:
+                tokens.append(r.value or [])
+        return tokens
+    return tokenize_all
+
+
+def tokenizer_options(f):
+    """Options shared by commands which split text into tokens."""
+    f = click.option('--tokenizer', type=click.Choice(TOKENIZERS), default='jisho', show_default=True,
+                     help='Tokenize on jisho.org, or locally by matching the words already in the library '
+                          '(cruder, but offline). Texts jisho.org can\'t tokenize are tokenized locally.')(f)
+    f = click.option('--chunk-size', type=click.IntRange(min=1), default=1000, show_default=True,
+                     help='(Maximum) Number of characters of text to tokenize in one request.')(f)
+    return f
+
+
+def add_results(library_cache: Library, results: list[Result], keep_payload: bool = False) -> list[Card]:
+    """Report on each word lookup, and add cards for the words that were found to the library. Doesn't save."""
+    # repeated words share a result, so only report (and add) each entry once
+    got = list({r.value.data[0].slug: r.value.data[0] for r in results if r.found}.values())
+    not_found = list(dict.fromkeys(r.query for r in results if r.error is None and r.value is None))
+    failed = [r for r in results if r.error is not None]
+
+    if not_found:
+        click.echo(f'No matches for {', '.join(not_found)}')
+    for r in failed:
+        click.echo(f'Couldn\'t fetch "{r.query}": {r.error}')
+    if got:
+        click.echo(f'Found {', '.join([c.slug for c in got])}')
+    cards = [Card.from_word(c, keep_payload) for c in got]
+    return library_cache.add(*cards)
+
+
+def report_saved(saved: int):
+    """Tell the user how many requests were saved by only making one for each distinct query."""
+    if saved:
+        click.echo(f'Saved {saved} requests by looking up repeated queries once.')
+
+
+def gen_words(words: list[str], workers: int = DEFAULT_WORKERS, rate: float = DEFAULT_RATE, offline: bool = False):
+    """Get and cache info on each word in the provided list of words (which may be separated by Japanese spaces)."""
     library_cache: Library = Library.get()
-    for c in got:
-        library_cache.cards.append(c)
+    words = split_words(words)
+
+    # don't look up words we already have cards for
+    in_library = library_cache.known(words)
+    known = [w for w in words if w in in_library]
+    words = [w for w in words if w not in in_library]
+    if known:
+        click.echo(f'Already in library: {', '.join(known)}')
+    if not words:
+        return
+
+    fetcher = Fetcher(workers, rate)
+    added = add_results(library_cache, fetcher.map(word_request(fetcher, ResponseCache(offline=offline)), words),
+                        Config.get().keep_payload)
+    report_saved(fetcher.saved)
+    if not added:
+        click.echo('No words added.')
+        return
     library_cache.save()
-    click.echo('Added to library.')
+    click.echo(f'Added {len(added)} to library.')
+
+
+def fetch_options(f):
+    """Options shared by commands which look up words on jisho.org."""
+    f = click.option('-w', '--workers', type=int, default=DEFAULT_WORKERS, show_default=True,
+                     help='Number of words to look up concurrently.')(f)
+    f = click.option('-r', '--rate', type=float, default=DEFAULT_RATE, show_default=True,
+                     help='Maximum number of requests started per second.')(f)
+    f = click.option('--offline', is_flag=True, default=False,
+                     help='Only use responses already in the local cache, without going online.')(f)
+    return f
+
+
+def profile_options(f):
+    """
+    Options for finding out where a command's time goes, shared by every command and command group.
+    When none are given, nothing is measured.
+    """
+    @functools.wraps(f)
+    def run(*args, profile, profile_json, cprofile, **kwargs):
+        if profile or profile_json or cprofile:
+            stop = profiling.start(cprofile)
+
+            def report():
+                result = stop()
+                if profile:
+                    click.echo(result.report(), err=True)
+                if profile_json:
+                    profiling.write_json(result, profile_json)
+            # for groups, this runs once the subcommand has finished too
+            click.get_current_context().call_on_close(report)
+        return f(*args, **kwargs)
+
+    run = click.option('--profile', is_flag=True, default=False,
+                       help='Print the time spent in each stage (network, decoding, rendering...) and counts of '
+                            'requests, cache hits, bytes and rows when done.')(run)
+    run = click.option('--profile-json', type=click.Path(dir_okay=False), default=None,
+                       help='Write the same breakdown to a JSON file.')(run)
+    run = click.option('--cprofile', type=click.Path(dir_okay=False), default=None,
+                       help='Write cProfile stats (for the main thread) to a file, for pstats or snakeviz.')(run)
+    return run
 
 
 @click.command('word')
 @click.argument('words', nargs=-1)
-def word(words):
+@fetch_options
+@profile_options
+def word(words, workers, rate, offline):
     """
     Create a card from the jisho.org entry on each of WORDS.
     This can be in English or Japanese (kanji, kana, romaji).
@@ -32,32 +181,37 @@ def word(words):
     # in which case they won't be separated. so, we do it ourselves
     ww: list[str] = sum([w.split('\u3000') for w in words], [])
 
-    gen_words(ww)
+    gen_words(ww, workers, rate, offline)
 
 
 @click.command()
 @click.argument('text', nargs=-1)
 @click.option('-all', 'all_tokens', is_flag=True, default=False,
               help='Cache every found token without first asking user to specify indices.')
-def token(text, all_tokens):
+@tokenizer_options
+@fetch_options
+@profile_options
+def token(text, all_tokens, tokenizer, chunk_size, workers, rate, offline):
     """
     Split the provided text into Japanese tokens, and write user determined set of these to cache.
+    Long texts are split into chunks, which are tokenized concurrently.
     """
     if not text:
         click.echo('No text provided.')
         return
 
-    text = ' '.join(text)
-    token_request = Tokens.request(text)
+    fetcher = Fetcher(workers, rate)
+    tokenize = text_tokenizer(tokenizer, fetcher, ResponseCache(offline=offline))
+    data = sum(tokenize(split_text(' '.join(text), chunk_size)), [])
+    report_saved(fetcher.saved)
 
     # abort if there are no matching tokens
-    if token_request is None:
+    if not data:
         click.echo('No tokens found.')
         return
 
     click.echo('Found tokens:')
-    data = token_request.data
-    click.echo('  '.join([f'({data.index(tk)}) {tk.token}' for tk in data]))
+    click.echo('  '.join([f'({i}) {tk}' for i, tk in enumerate(data)]))
 
     # get indices
     prompted_indices = (click.prompt('Please enter a list of indices for the tokens you want to generate cards for',
@@ -69,13 +223,138 @@ def token(text, all_tokens):
         except ValueError:
             click.echo(f'Invalid index: {i}')
             return
-    selected = [data[index].token for index in indices] if indices else [tk.token for tk in data]
+    selected = [data[index] for index in indices] if indices else data
 
     # generate word cards
-    gen_words(selected)
+    gen_words(selected, workers, rate, offline)
+
+
+def _read_lines(path: str, start: int = 0) -> Iterator[tuple[str, int]]:
+    """Stream lines from a file (or stdin, for -), with the byte offset just after each line."""
+    file = sys.stdin.buffer if path == '-' else open(path, 'rb')
+    try:
+        if start:
+            file.seek(start)
+        offset = start
+        for raw in file:
+            offset += len(raw)
+            yield raw.decode('utf-8', errors='replace'), offset
+    finally:
+        if file is not sys.stdin.buffer:
+            file.close()
+
+
+def _text_chunks(lines: Iterator[tuple[str, int]], size: int) -> Iterator[tuple[str, int]]:
+    """
+    Group lines of text into chunks of at most `size` characters, with the offset up to which input is covered.
+    Lines longer than a chunk are split at sentence ends (like `token` splits texts), and their pieces report
+    the offset of the start of the line.
+    """
+    chunk, covered = '', 0
+    for line, offset in lines:
+        line = line.strip()
+        if len(line) > size:
+            if chunk:
+                yield chunk, covered
+                chunk = ''
+            *pieces, line = split_text(line, size)
+            for piece in pieces:
+                yield piece, covered
+        if chunk and len(chunk) + len(line) + 1 > size:
+            yield chunk, covered
+            chunk = ''
+        chunk = f'{chunk} {line}' if chunk else line
+        covered = offset
+    if chunk:
+        yield chunk, covered
+
+
+@click.command()
+@click.argument('files', nargs=-1, type=click.Path(exists=True, dir_okay=False, allow_dash=True))
+@click.option('-t', '--text', 'is_text', is_flag=True, default=False,
+              help='Input is Japanese text to split into tokens, rather than a list of words.')
+@tokenizer_options
+@click.option('--checkpoint', type=int, default=100, show_default=True,
+              help='Number of new words to look up between saves to the library.')
+@click.option('--restart', is_flag=True, default=False,
+              help='Start each file from the beginning, instead of where an earlier run stopped.')
+@fetch_options
+@profile_options
+def batch(files, is_text, tokenizer, chunk_size, checkpoint, restart, workers, rate, offline):
+    """
+    Create cards for every word in FILES (or stdin, if none are given), without asking for any input.
+    Words are separated by whitespace, or found by tokenizing the input with -t.
+    \nThe library is saved every --checkpoint words, and an interrupted run picks up where it stopped in each file.
+    Words which couldn't be looked up (e.g. network errors) are looked up again by the next run.
+    """
+    library_cache: Library = Library.get()
+    keep_payload = Config.get().keep_payload
+    progress = BatchProgress.get()
+    fetcher = Fetcher(workers, rate)
+    cache = ResponseCache(offline=offline)
+    request = word_request(fetcher, cache)
+    tokenize = text_tokenizer(tokenizer, fetcher, cache)
+
+    seen: set[str] = set()
+    pending: list[str] = []
+    added_count = 0
+    repeated = 0
+    failed = 0
+    # files with a lookup which failed: their progress stays before it, so the next run tries again
+    stalled: set[str] = set()
+
+    def commit(path: str, offset: int):
+        nonlocal added_count, failed
+        # checked against the library together, rather than a word at a time
+        in_library = library_cache.known(pending)
+        pending[:] = [w for w in pending if w not in in_library]
+        if pending:
+            results = fetcher.map(request, pending)
+            added = add_results(library_cache, results, keep_payload)
+            if added:
+                library_cache.save()
+            added_count += len(added)
+            errors = sum(r.error is not None for r in results)
+            if errors:
+                failed += errors
+                stalled.add(path)
+            pending.clear()
+        if path != '-' and path not in stalled:
+            progress.update(path, offset)
+            progress.save()
+
+    for path in files or ['-']:
+        start = 0 if restart or path == '-' else progress.offset(path)
+        if start:
+            click.echo(f'Resuming {path} from byte {start}.')
+        lines = _read_lines(path, start)
+        offset = start
+
+        if is_text:
+            groups = ((covered, tokenize([chunk])[0]) for chunk, covered in _text_chunks(lines, chunk_size))
+        else:
+            groups = ((covered, line.split()) for line, covered in lines)
+        for offset, words in groups:
+            # dedupe against this run before fetching, and against the library at the checkpoint
+            for w in split_words(words):
+                if w in seen:
+                    repeated += 1
+                else:
+                    seen.add(w)
+                    pending.append(w)
+            if len(pending) >= checkpoint:
+                commit(path, offset)
+        commit(path, offset)
+
+    report_saved(repeated + fetcher.saved)
+    click.echo(f'Added {added_count} to library.')
+    if failed:
+        click.echo(f'Couldn\'t look up {failed} words. Run batch again to retry them.')
+        click.get_current_context().exit(1)
 
 
 @click.group('library')
+@profile_options
 def library():
     return
 
@@ -84,51 +363,156 @@ def library():
 @click.option('-in', '--indices', is_flag=True, default=False, help='Display cards with indices')
 def view(indices):
     """Echo information on the current cached library of words."""
-    result = Library.get()
-    click.echo(', '.join([(f'[{result.cards.index(c)}] ' if indices else '') + word_japanese(c) for c in result.cards])
-               if result.cards.__len__() > 0 else 'No cached cards.')
+    # only the written forms are needed, so no cards are decoded
+    entries = Library.entries()
+    click.echo(', '.join([(f'[{i}] ' if indices else '') + w for i, (_, w) in enumerate(entries)])
+               if entries else 'No cached cards.')
 
 
 @library.command()
-def clear():
+@click.option('-r', '--responses', is_flag=True, default=False,
+              help='Also clear the cache of jisho.org responses, so that words are looked up afresh.')
+def clear(responses):
     """Clear library cache."""
+    responses = responses and os.path.isfile(ResponseCache.PATH)
     if list(filter(lambda x: x is True,
-                   [os.path.isfile(path) for path in [Library.PATH, Examples.PATH]])).__len__() == 0:
+                   [os.path.isfile(path) for path in [Library.PATH, Library.LEGACY_PATH,
+                                                      Examples.PATH, Examples.LEGACY_PATH]])).__len__() == 0 \
+            and not responses:
         click.echo('No library cache to clear.')
         return
 
-    caches = Library, Examples
+    # batch progress too, or batch runs would resume past the words that were cleared
+    caches = Library, Examples, BatchProgress
     if click.confirm('Are you sure you want to clear library?', abort=True):
         for cache in caches:
             cache.delete_file()
+        if responses:
+            ResponseCache().clear()
+
+
+@library.command()
+def compact():
+    """Shrink cards saved by older versions, which stored every jisho.org entry in full."""
+    click.echo(f'Compacted {Library.compact()} cards.')
+
+
+SPLITS = ['shard', 'jlpt', 'tag']
+
+
+def _part_name(split: str, group: str | None) -> str:
+    """File name part for a group of a split export."""
+    if group is None:
+        return f'no-{split}'
+    return ''.join(c if c.isalnum() or c in '-_' else '_' for c in group)
+
+
+def _export_columns(output_file: str, export_format: str) -> bool:
+    """Write the whole library as columns, for analysis rather than Anki. Returns whether it did."""
+    try:
+        write = column_writer(export_format)
+    except ImportError as e:
+        click.echo(f'Exporting to {export_format} needs {e.name}, which isn\'t installed (pip install {e.name}).')
+        return False
+    columns = card_columns(Library.iter_cards(), Config.get(), Examples.get().examples)
+    with profiling.stage('columnar write'):
+        write(output_file, columns)
+    click.echo(f'Exported {len(columns["slug"])} cards to {output_file}.')
+    return True
 
 
 @library.command('export')
-@click.option('-o', '--output-file', type=click.File('w'), default='out.csv')
+@click.option('-o', '--output-file', type=click.Path(dir_okay=False, allow_dash=True), default=None,
+              help='File to export to (out.csv, or out.parquet etc. for other formats). Use - to write CSV to stdout.')
+@click.option('-f', '--format', 'export_format', type=click.Choice(FORMATS), default=None,
+              help='CSV for Anki, or the library as columns (the header fields, and each card\'s senses, JLPT levels '
+                   'and tags as lists) in Parquet (needs pyarrow) or a compressed NumPy .npz (needs numpy), '
+                   'for analysis. Defaults to the output file\'s extension, or CSV.')
+@click.option('-z', '--gzip', 'compress', is_flag=True, default=False,
+              help='Compress the export with gzip. Implied by an output file ending in .gz.')
 @click.option('-c', '--clear', 'clear_after_export', is_flag=True, default=False,
               help='Clear library cache after exporting.')
-def export(output_file, clear_after_export):
-    """Export the current cached library to a CSV file."""
-    # can't export from a nonexistent library
-    if not os.path.isfile(Library.PATH):
+@click.option('-i', '--incremental', is_flag=True, default=False,
+              help='Only export cards added or changed (including their examples) since the last export.')
+@click.option('-j', '--jobs', type=int, default=1, show_default=True,
+              help='Number of processes to render cards in. Rows are still written in library order.')
+@click.option('-s', '--split', type=click.Choice(SPLITS), default=None,
+              help='Write a file per shard (--jobs of them), or per JLPT level or tag (the first of each card\'s), '
+                   'named after the output file, e.g. out-jlpt-n5.csv.')
+def export(output_file, export_format, compress, clear_after_export, incremental, jobs, split):
+    """Export the current cached library to a CSV file for Anki, or to a columnar file for analysis."""
+    # can't export from an empty library
+    if not Library.count():
         click.echo('No cached cards to export.')
         return
-
-    # gather card data
-    library_cache = Library.get()
+    if export_format is None:
+        suffix = os.path.splitext(output_file or '')[1].lstrip('.')
+        export_format = suffix if suffix in FORMATS else 'csv'
+    output_file = output_file or f'out.{export_format}'
+    if export_format != 'csv':
+        # a snapshot of the whole library, which doesn't count as an export of it for -i
+        if output_file == '-' or compress or incremental or split:
+            click.echo(f'Can\'t use -o -, -z, -i or -s with {export_format}: '
+                       f'columnar exports are of the whole library, to a compressed file.')
+            return
+        exported = _export_columns(output_file, export_format)
+    else:
+        exported = _export_rows(output_file, compress, incremental, jobs, split)
+    # clear cache
+    if exported and clear_after_export:
+        click.echo(f'Clearing library cache...', err=output_file == '-')
+        Library.delete_file()
+        click.echo('Done.', err=output_file == '-')
+
+
+def _export_rows(output_file: str, compress: bool, incremental: bool, jobs: int, split: str | None) -> bool:
+    """Write the library (or what changed since the last export) as CSV, for Anki. Returns whether it did."""
+    to_stdout = output_file == '-'
+    if split and to_stdout:
+        click.echo('Can\'t split an export to stdout.')
+        return False
+
+    # taken before reading anything, so that whatever is changed meanwhile gets a higher stamp,
+    # and is exported again next time
+    cards_up_to, examples_up_to = Library.last_stamp(), Examples.last_stamp()
     configs = Config.get()
     examples = Examples.get()
 
-    # write export
-    output_file.write(csv_header(configs))
-    for row in [word_to_csv(c, configs, examples.examples.get(c.slug)) for c in library_cache.cards]:
-        output_file.write(row)
-
-    # clear cache
-    if clear_after_export:
-        click.echo(f'Clearing library cache...')
-        os.remove(Library.PATH)
-        click.echo('Done.')
+    exported = Library.exported() if incremental else None
+    since, changed = None, set()
+    if exported is not None:
+        since = exported[0]
+        changed = Examples.changed_since(exported[1])
+    total = Library.count(since, changed)
+    if not total:
+        click.echo('No cards changed since the last export.', err=to_stdout)
+        return False
+
+    # write export, streaming rows from the library.
+    # rows are only rendered for cards (or settings) which changed since they were last exported
+    outputs: dict[str | None, TextIO] = {}
+    try:
+        with data_renderer(configs, examples.examples, jobs) as render:
+            # each worker gets around a thousand cards at a time, to make up for sending them between processes
+            rows = Library.iter_rendered(configs.fingerprint(), render, examples.examples, since, changed,
+                                         group=split if split != 'shard' else None, batch_size=1000 * max(1, jobs))
+            for i, (group, row) in enumerate(profiling.written(rows, 'rows exported', lambda r: r[1])):
+                if split == 'shard':
+                    group = str(i * jobs // total + 1)
+                output = outputs.get(group)
+                if output is None:
+                    path = split_path(output_file, _part_name(split, group)) if split else output_file
+                    output = outputs[group] = open_output(path, compress)
+                    output.write(csv_header(configs))
+                output.write(row)
+    finally:
+        if not to_stdout:
+            for output in outputs.values():
+                output.close()
+    Library.mark_exported(cards_up_to, examples_up_to)
+    if split:
+        click.echo(f'Exported {total} cards to {len(outputs)} files.')
+    return True
 
 
 @library.command()
@@ -140,67 +524,132 @@ def delete(words, indices):
         click.echo('Specify words to delete.')
         return
 
-    library_cache = Library.get()
     removed: list[str] = []
     not_found: list[str] = []
-    for w in sum([w.split('\u3000') for w in words], []):
-        if not indices:
-            match = list(filter(lambda x: w == word_japanese(x), library_cache.cards))
-            if match:
-                removed.append(word_japanese(match[0]))
-                library_cache.cards.remove(match[0])
-            else:
-                not_found.append(w)
-        else:
-            if not w.isdigit() or int(w) >= library_cache.cards.__len__() or int(w) < 0:
+    ww = sum([w.split('\u3000') for w in words], [])
+    if indices:
+        # positions only need the sorted list of slugs, not the cards themselves
+        entries = Library.entries()
+        slugs: list[str] = []
+        for w in ww:
+            if not w.isdigit() or int(w) >= entries.__len__() or int(w) < 0:
                 click.echo(f'Invalid index: {w}')
                 break
-            removed.append(word_japanese(library_cache.cards[int(w)]))
-            library_cache.cards.remove(library_cache.cards[int(w)])
+            slug, written = entries.pop(int(w))
+            slugs.append(slug)
+            removed.append(written)
+        if removed:
+            click.echo(f'Removed {', '.join(removed)} from library.')
+            Library.discard(slugs)
+        else:
+            click.echo('Couldn\'t find any matching words to delete.')
+        return
+
+    library_cache = Library.get()
+    # look every word up together, then remove the matches together
+    found = library_cache.lookup(ww)
+    matched: dict[str, Card] = {}
+    ambiguous: list[str] = []
+    for w in ww:
+        match = [c for c in found[w] if card_key(c) not in matched]
+        # a slug picks out its card among those sharing its written form
+        match = [c for c in match if c.slug == w] or match
+        if len(match) == 1:
+            removed.append(word_japanese(match[0]))
+            matched[card_key(match[0])] = match[0]
+        elif match:
+            # e.g. a reading shared by several words: don't guess which one was meant
+            ambiguous.append(f'{w} ({', '.join(f'{word_japanese(c)}: {c.slug}' for c in match)})')
+        else:
+            not_found.append(w)
+    library_cache.remove(*matched.values())
 
     if removed:
         click.echo(f'Removed {', '.join(removed)} from library.')
-        if not_found:
-            click.echo(f'Couldn\'t find {', '.join(not_found)}, so not removed.')
         library_cache.save()
-    else:
+    if ambiguous:
+        click.echo(f'Several cards match {', '.join(ambiguous)}, so not removed. Delete them by slug instead.')
+    if not_found and (removed or ambiguous):
+        click.echo(f'Couldn\'t find {', '.join(not_found)}, so not removed.')
+    elif not_found:
         click.echo('Couldn\'t find any matching words to delete.')
 
 
+SENTENCE_POLICIES = ['prompt', 'first', 'shortest']
+
+
+def choose_sentence(policy: str, w: Card, options: list) -> int:
+    """
+    Pick one of the example sentence options for a word, according to the policy.
+    Returns its index, counting from 1. An index below 1 means none was chosen.
+    """
+    if not options:
+        return 0
+    match policy:
+        case 'first':
+            return 1
+        case 'shortest':
+            return min(range(len(options)), key=lambda n: len(options[n].japanese)) + 1
+
+    click.echo(f'Example sentences for {word_japanese(w)}:\n'
+               f'{'\n'.join([f'({i + 1})\t{r.japanese} ({r.en_translation})'
+                             for i, r in enumerate(options)])}')
+    # get user input, keep asking until they give a valid integer
+    i = None
+    while not i:
+        i = click.prompt('Please enter the index for the example sentence you want to include',
+                         type=int, default=-1)
+
+        if i > len(options):
+            click.echo(f'Index {i} out of bounds for range [1, {len(options)}]')
+            i = None
+    return i
+
+
 @library.command()
 @click.argument('words', nargs=-1)
 @click.option('-in', '--indices', is_flag=True, default=False,
               help='Take list of (zero indexed) indices instead of full words.')
+@click.option('-p', '--policy', type=click.Choice(SENTENCE_POLICIES), default='prompt', show_default=True,
+              help='How to pick each example sentence. Anything but "prompt" runs without asking for input.')
 @click.option('-cf', '--choose-first', is_flag=True, default=False,
-              help='Automatically choose the first available example sentence. WARNING: Don\'t trust they\'ll be good.')
+              help='Automatically choose the first available example sentence. WARNING: Don\'t trust they\'ll be good. '
+                   'Same as --policy first.')
 @click.option('-ow', '--overwrite', is_flag=True, default=False,
               help='Overwrite existing examples.')
 @click.option('-n', '--num-options', type=int, default=5,
               help='(Maximum) Number of example sentences to offer as options.')
-def example(words, choose_first, overwrite, num_options, indices):
+@fetch_options
+def example(words, policy, choose_first, overwrite, num_options, indices, workers, rate, offline):
     """ Generate examples to associate with the given words in the library.
     \nWARNING: The sentence scraping API often returns incomplete sentences.
     It's not my fault. Read carefully before choosing."""
 
     # get matching words from library
-    library_cache = Library.get()
-    match: list[WordConfig] = []
-    if words:
+    match: list[Card] = []
+    if words and indices:
+        # only decode the cards at the given positions
+        entries = Library.entries()
+        slugs: list[str] = []
         for w in words:
-            if not indices:
-                matched = list(filter(lambda x: w == word_japanese(x), library_cache.cards))
-                if matched:
-                    match += matched
-                else:
-                    click.echo(f'Couldn\'t find "{w}" in library')
+            if not w.isdigit() or int(w) >= entries.__len__() or int(w) < 0:
+                click.echo(f'Invalid index: {w}')
+                break
+            slugs.append(entries[int(w)][0])
+        match = Library.load(slugs)
+    elif words:
+        found = Library.get().lookup(words)
+        for w in words:
+            matched = found[w]
+            if matched:
+                match += matched
             else:
-                if not w.isdigit() or int(w) >= library_cache.cards.__len__() or int(w) < 0:
-                    click.echo(f'Invalid index: {w}')
-                    break
-                match.append(library_cache.cards[int(w)])
+                click.echo(f'Couldn\'t find "{w}" in library')
     # get all words if none specified
     else:
-        match = library_cache.cards
+        match = list(Library.iter_cards())
+    # several words can match the same card, but it only needs one example
+    match = list({c.slug: c for c in match}.values())
     # can't do much with no words
     if not match:
         click.echo('No matching words in library')
@@ -212,36 +661,39 @@ def example(words, choose_first, overwrite, num_options, indices):
     if not overwrite:
         match = list(filter(lambda x: not examples.examples.get(x.slug), match))
 
-    # process sentence requests for each word
-    for w in match:
-        requests = Sentence.request(w.slug).data[:num_options]  # capped
-
-        # user chooses index of sentence to add
-        i = 0
-        if not choose_first:
-            i = None
-            click.echo(f'Example sentences for {word_japanese(w)}:\n'
-                       f'{'\n'.join([f'({i + 1})\t{r.japanese} ({r.en_translation})' 
-                                     for i, r in enumerate(requests)])}')
-            # get user input, keep asking until they give a valid integer
-            while not i:
-                i = click.prompt('Please enter the index for the example sentence you want to include',
-                                 type=int, default=-1)
-
-                if i > len(requests):
-                    click.echo(f'Index {i} out of bounds for range [1, {len(requests)}]')
-                    i = None
+    # start fetching sentences for every word in the background straight away,
+    # so that the user isn't kept waiting on the network before each prompt
+    from jisho_api.sentence.request import SentenceRequest
+    fetcher = Fetcher(workers, rate)
+    request = ResponseCache(offline=offline).wrap('sentence', fetcher.limited(request_sentences), SentenceRequest)
+    if choose_first:
+        policy = 'first'
+
+    updated = 0
+    for w, result in zip(match, fetcher.stream(request, [w.slug for w in match])):
+        if result.error is not None:
+            click.echo(f'Couldn\'t get example sentences for {word_japanese(w)}: {result.error}')
+            continue
+        if result.value is None:
+            continue
+        options = result.value.data[:num_options]  # capped
+
+        # index (from 1) of the sentence to add, anything lower to skip
+        i = choose_sentence(policy, w, options)
         # update examples object
         if i > 0:
-            examples.examples.update({w.slug: requests[i]})
-        elif overwrite:
-            examples.examples.pop(w.slug, None)
+            examples.examples.update({w.slug: options[i - 1]})
+            updated += 1
+        elif overwrite and examples.examples.pop(w.slug, None):
+            updated += 1
     # save to disk
-    click.echo(f'{match.__len__()} examples updated.')
+    report_saved(fetcher.saved)
+    click.echo(f'{updated} examples updated.')
     examples.save()
 
 
 @click.group('config')
+@profile_options
 def config():
     return
 
@@ -257,7 +709,7 @@ def clear():
     """Clear config file."""
     if os.path.isfile(Config.PATH):
         if click.confirm('Are you sure you want to clear config file?', abort=True):
-            os.remove(Config.PATH)
+            Config.delete_file()
             click.echo('Config file cleared.')
     else:
         click.echo('No config file to clear.')
@@ -268,12 +720,20 @@ def clear():
 @click.option('-rm', '--remove', is_flag=True, default=False, help='')
 def senses(sense_count, remove):
     """The (max) number of senses to export for each word."""
-    configs = Config.get()
-    configs.senses = None if remove else sense_count
-    configs.save()
+    with Config.edit() as configs:
+        configs.senses = None if remove else sense_count
     click.echo('Senses value updated.')
 
 
+@config.command()
+@click.argument('keep', type=bool)
+def payload(keep):
+    """Whether to keep the full jisho.org entry with each new card (true/false), for fields that might need it."""
+    with Config.edit() as configs:
+        configs.keep_payload = keep
+    click.echo('Payload setting updated.')
+
+
 @click.group('header')
 def header():
     """Configure items for Anki file header."""
@@ -285,12 +745,11 @@ def header():
 @click.option('-rm', '--remove', is_flag=True, default=False, help='Remove field from header')
 def tags(all_tags, remove):
     """Update the tags list. For tags that will be automatically applied to each card on import."""
-    configs = Config.get()
-    if remove:
-        configs.header.tags = None
-    elif all_tags:
-        configs.header.tags = all_tags
-    configs.save()
+    with Config.edit() as configs:
+        if remove:
+            configs.header.tags = None
+        elif all_tags:
+            configs.header.tags = all_tags
     click.echo('Header tags updated.')
 
 
@@ -299,12 +758,11 @@ def tags(all_tags, remove):
 @click.option('-rm', '--remove', is_flag=True, default=False, help='Remove field from header')
 def deck(title, remove):
     """Update the deck title."""
-    configs = Config.get()
-    if remove:
-        configs.header.deck = None
-    elif title:
-        configs.header.deck = title
-    configs.save()
+    with Config.edit() as configs:
+        if remove:
+            configs.header.deck = None
+        elif title:
+            configs.header.deck = title
     click.echo('Header deck updated.')
 
 
@@ -319,18 +777,26 @@ def fields(word_fields, valid_options, remove):
         click.echo(f'Valid field options: {Config.HeaderConfig.VALID_FIELDS}')
         return
 
-    configs = Config.get()
-    if remove:
-        configs.header.tags = None
-        configs.save()
-    else:
-        # make config update
-        try:
-            configs.header.fields = word_fields
-            click.echo('Updated fields.')
-            configs.save()
-        except KeyError as e:
-            click.echo(f'Couldn\'t update config: {e}')
+    # make config update
+    try:
+        with Config.edit() as configs:
+            if remove:
+                configs.header.tags = None
+            else:
+                configs.header.fields = word_fields
+                click.echo('Updated fields.')
+    except KeyError as e:
+        click.echo(f'Couldn\'t update config: {e}')
 
 
 config.add_command(header)
+
+
+@click.command()
+def serve():
+    """
+    Keep running, and run the word, token, batch, library and config commands started meanwhile in this process,
+    with the library, examples and config kept loaded between them. Stop with Ctrl+C.
+    """
+    import serving
+    serving.serve({'word': word, 'token': token, 'batch': batch, 'library': library, 'config': config})
@@ -0,0 +1,87 @@
+"""
+Offline stand-in for the jisho.org endpoints used by jisho-nomikomi.
+
+`install()` replaces the word, token and sentence requests with local functions which wait `latency` seconds,
+like a network round trip would, and then answer with synthetic entries. Every query is found.
+"""
+import time
+
+KANA = 'あいうえおかきくけこさしすせそたちつてとなにぬねのはひふへほまみむめもやゆよらりるれろわん'
+KANJI = '日月火水木金土山川田人口目耳手足力上下左右中大小本文字学生先年'
+JLPT = ['jlpt-n5', 'jlpt-n4', 'jlpt-n3', 'jlpt-n2', 'jlpt-n1']
+
+
+def _digits(n: int, alphabet: str, length: int) -> str:
+    out = ''
+    for _ in range(length):
+        n, d = divmod(n, len(alphabet))
+        out = alphabet[d] + out
+    return out
+
+
+def written(i: int) -> str:
+    """The written form of synthetic word number `i`."""
+    return _digits(i, KANJI, 5)
+
+
+def number(word: str) -> int:
+    """The number of the synthetic word with this written form (0 for anything else)."""
+    n = 0
+    for c in word:
+        if c not in KANJI:
+            return 0
+        n = n * len(KANJI) + KANJI.index(c)
+    return n
+
+
+def reading(i: int) -> str:
+    return _digits(i, KANA, 4)
+
+
+def words(n: int) -> list[str]:
+    return [written(i) for i in range(n)]
+
+
+def word_data(i: int, senses: int = 3) -> dict:
+    """A synthetic entry shaped like the `data` items of a jisho.org word search."""
+    return {
+        'slug': written(i),
+        'is_common': i % 2 == 0,
+        'tags': [f'wanikani{i % 60 + 1}'] if i % 3 == 0 else [],
+        'jlpt': [JLPT[i % len(JLPT)]],
+        'japanese': [{'word': written(i), 'reading': reading(i)},
+                     {'word': None, 'reading': reading(i)}],
+        'senses': [{
+            'english_definitions': [f'meaning {i}.{s}', f'sense {s} of word {i}'],
+            'parts_of_speech': ['Noun', 'Suru verb'] if s == 0 else ['Noun'],
+            'links': [], 'tags': [], 'restrictions': [], 'see_also': [], 'antonyms': [], 'source': [], 'info': [],
+        } for s in range(senses)],
+        'attribution': {'jmdict': True, 'jmnedict': False, 'dbpedia': False},
+    }
+
+
+def install(latency: float = 0.0, senses: int = 3, sentences: int = 5):
+    """Patch the application's word, token and sentence requests with offline fakes."""
+    import application
+    from jisho_api.sentence.request import SentenceRequest
+    from jisho_api.tokenize.request import TokenRequest
+    from jisho_api.word.request import WordRequest
+
+    def word_request(query: str, cache: bool = False):
+        time.sleep(latency)
+        return WordRequest.parse_obj({'meta': {'status': 200}, 'data': [word_data(number(query), senses)]})
+
+    def token_request(text: str, cache: bool = False):
+        time.sleep(latency)
+        return TokenRequest.parse_obj({'meta': {'status': 200},
+                                       'data': [{'token': t, 'pos_tag': 'Noun'} for t in text.split()]})
+
+    def sentence_request(query: str):
+        time.sleep(latency)
+        return SentenceRequest.parse_obj({'meta': {'status': 200}, 'data': [
+            {'japanese': f'{query}の例文{n}です。', 'en_translation': f'Example sentence {n} for {query}.'}
+            for n in range(sentences)]})
+
+    application.request_word = word_request
+    application.request_tokens = token_request
+    application.request_sentences = sentence_request
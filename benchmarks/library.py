@@ -0,0 +1,184 @@
+"""
+Throughput and peak memory of the library operations, against an offline stand-in for jisho.org.
+
+Every operation runs in a fresh interpreter with its own temporary ~/.nomikomi, at each library size.
+The library it works on is set up by a separate interpreter beforehand, so that setup doesn't count.
+
+    python benchmarks/library.py [-s SIZES] [-o OPERATIONS] [--latency SECONDS] [--json FILE] [--compare FILE]
+
+gen_words needs jisho_api installed, for the stand-in's response models.
+"""
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable
+
+import click
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(ROOT), str(ROOT / 'benchmarks')]
+
+SIZES = [100, 1_000, 10_000]
+
+
+def _cards(n: int) -> list:
+    from cards import Card, Form, Sense
+    import fake_jisho
+    cards = []
+    for i in range(n):
+        data = fake_jisho.word_data(i)
+        cards.append(Card(data['slug'], [Form(j['word'], j['reading']) for j in data['japanese']],
+                          [Sense(s['english_definitions'], s['parts_of_speech']) for s in data['senses']],
+                          data['jlpt'], data['tags']))
+    return cards
+
+
+def _build(n: int):
+    from configuration import Library
+    Library(_cards(n)).save()
+
+
+def _gen_words(n: int, args: dict) -> Callable[[], None]:
+    import application
+    import fake_jisho
+    fake_jisho.install(args['latency'])
+    words = fake_jisho.words(n)
+    return lambda: application.gen_words(words, args['workers'], rate=0)
+
+
+def _add(n: int, args: dict) -> Callable[[], None]:
+    from configuration import Library
+    card = _cards(n + 1)[n]
+
+    def add():
+        library = Library.get()
+        library.add(card)
+        library.save()
+    return add
+
+
+def _save(n: int, args: dict) -> Callable[[], None]:
+    from configuration import Library
+    library = Library(_cards(n))
+    return library.save
+
+
+def _export(n: int, args: dict = None) -> Callable[[], None]:
+    import application
+    return lambda: application.library(['export', '-o', os.devnull], standalone_mode=False)
+
+
+def _build_and_export(n: int):
+    _build(n)
+    _export(n)()
+
+
+def _deleted(n: int) -> list[str]:
+    """Every tenth word, for bulk deletes."""
+    import fake_jisho
+    return [fake_jisho.written(i) for i in range(0, n, 10)]
+
+
+def _delete(n: int, args: dict) -> Callable[[], None]:
+    import application
+    words = _deleted(n)
+    return lambda: application.library(['delete', *words], standalone_mode=False)
+
+
+# name -> (setup, operation, number of items it processes).
+# setup runs in its own interpreter before the timed one. operations prepare their input, and return what to time
+OPERATIONS = {
+    'gen_words': (None, _gen_words, lambda n: n),
+    # a single word into a library of n
+    'library_add': (_build, _add, lambda n: 1),
+    'library_save': (None, _save, lambda n: n),
+    'export': (_build, _export, lambda n: n),
+    # rows are rendered by the first export, so the second reuses them
+    'export_unchanged': (_build_and_export, _export, lambda n: n),
+    'delete': (_build, _delete, lambda n: len(_deleted(n))),
+}
+
+
+def child(operation: str, size: int, setup: bool, args: dict) -> dict | None:
+    """Runs in the benchmark's own interpreter, with HOME pointed at its temporary directory."""
+    before, prepare, items = OPERATIONS[operation]
+    if setup:
+        if before:
+            before(size)
+        return None
+    run = prepare(size, args)
+    # imports and input don't count towards the operation
+    peak_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    run()
+    seconds = time.perf_counter() - start
+    peak_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        'operation': operation,
+        'size': size,
+        'items': items(size),
+        'seconds': round(seconds, 4),
+        'items_per_second': round(items(size) / seconds, 1) if seconds else None,
+        'peak_rss_kb': peak_after,
+        'peak_rss_added_kb': peak_after - peak_before,
+    }
+
+
+def measure(operation: str, size: int, args: dict) -> dict:
+    with tempfile.TemporaryDirectory() as home:
+        env = dict(os.environ, HOME=home)
+        result = Path(home) / 'result.json'
+        for setup in [True, False]:
+            code = (f'import json, sys; sys.path.insert(0, {str(ROOT / "benchmarks")!r}); import library\n'
+                    f'result = library.child({operation!r}, {size}, {setup}, {args!r})\n'
+                    f'if result: open({str(result)!r}, "w").write(json.dumps(result))')
+            process = subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=env,
+                                     stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+            if process.returncode:
+                raise click.ClickException(f'{operation} at {size} failed:\n{process.stderr}')
+        return json.loads(result.read_text())
+
+
+@click.command()
+@click.option('-s', '--sizes', default=','.join(map(str, SIZES)), show_default=True,
+              help='Comma separated library sizes, e.g. 100,1000,10000,100000,1000000.')
+@click.option('-o', '--operations', default=','.join(OPERATIONS), show_default=True,
+              help='Comma separated operations to measure.')
+@click.option('--latency', type=float, default=0.0, show_default=True,
+              help='Seconds each stand-in jisho.org request takes.')
+@click.option('-w', '--workers', type=int, default=4, show_default=True, help='Workers for gen_words.')
+@click.option('--json', 'json_file', type=click.File('w'), default=None, help='Also write results as JSON.')
+@click.option('--compare', type=click.File('r'), default=None,
+              help='JSON results of an earlier run, to compare against.')
+def main(sizes, operations, latency, workers, json_file, compare):
+    sizes = [int(float(s)) for s in sizes.split(',')]
+    operations = operations.split(',')
+    for operation in operations:
+        if operation not in OPERATIONS:
+            raise click.BadParameter(f'"{operation}" is not one of {", ".join(OPERATIONS)}', param_hint='operations')
+    args = {'latency': latency, 'workers': workers}
+    earlier = {(r['operation'], r['size']): r for r in json.load(compare)['results']} if compare else {}
+
+    results = []
+    for operation in operations:
+        for size in sizes:
+            r = measure(operation, size, args)
+            results.append(r)
+            line = (f'{operation:18} {size:>9} {r["seconds"] * 1000:10.1f} ms {r["items_per_second"] or 0:12.0f}/s '
+                    f'{r["peak_rss_added_kb"] / 1024:8.1f} MB')
+            if (operation, size) in earlier:
+                line += f'  ({r["seconds"] / earlier[operation, size]["seconds"]:.2f}x time)'
+            click.echo(line)
+
+    if json_file:
+        json.dump({'python': sys.version, 'latency': latency, 'workers': workers, 'results': results},
+                  json_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
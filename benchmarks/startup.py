@@ -0,0 +1,88 @@
+"""
+Startup time of the console scripts.
+
+Runs each command in a fresh interpreter, the way the console scripts do, and reports the median wall time.
+Commands run against an empty ~/.nomikomi in a temporary home directory, unless --home is given.
+
+    python benchmarks/startup.py [-n RUNS] [--home DIR] [--json FILE]
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import click
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# (console script, arguments)
+COMMANDS = [
+    ('config', ['view']),
+    ('library', ['view']),
+    ('library', ['export', '-o', os.devnull]),
+    ('word', ['--help']),
+    ('token', ['--help']),
+]
+
+# jisho_api (and its requests/pydantic/bs4/rich stack) and jsonpickle shouldn't be imported by local commands
+HEAVY_MODULES = ['jisho_api', 'requests', 'pydantic', 'bs4', 'rich', 'jsonpickle']
+
+
+def run_baseline(env: dict) -> float:
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', 'pass'], env=env)
+    return time.perf_counter() - start
+
+
+def run(script: str, args: list[str], env: dict) -> float:
+    code = f'import sys, application; sys.argv[0] = {script!r}; application.{script}({args!r})'
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=env,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def imported(script: str, args: list[str], env: dict) -> list[str]:
+    """Which of the heavy modules end up imported by a command."""
+    code = (f'import sys, application\n'
+            f'try:\n    application.{script}({args!r})\nexcept SystemExit:\n    pass\n'
+            f'print(" ".join(m for m in {HEAVY_MODULES!r} if m in sys.modules), file=sys.stderr)')
+    result = subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    return result.stderr.strip().splitlines()[-1].split() if result.stderr.strip() else []
+
+
+@click.command()
+@click.option('-n', '--runs', type=int, default=10, show_default=True, help='Runs per command.')
+@click.option('--home', type=click.Path(file_okay=False), default=None,
+              help='Home directory to run in. Defaults to an empty temporary one.')
+@click.option('--json', 'json_file', type=click.File('w'), default=None, help='Also write results as JSON.')
+def main(runs, home, json_file):
+    with tempfile.TemporaryDirectory() as temp:
+        env = dict(os.environ, HOME=home or temp)
+        baseline = statistics.median([run_baseline(env) for _ in range(runs)])
+        results = []
+        for script, args in COMMANDS:
+            times = [run(script, args, env) for _ in range(runs)]
+            results.append({
+                'command': ' '.join([script] + args),
+                'median_ms': round(statistics.median(times) * 1000, 1),
+                'min_ms': round(min(times) * 1000, 1),
+                'heavy_imports': imported(script, args, env),
+            })
+
+    click.echo(f'{"bare interpreter":40} {baseline * 1000:8.1f} ms')
+    for r in results:
+        click.echo(f'{r["command"]:40} {r["median_ms"]:8.1f} ms  (min {r["min_ms"]:.1f})'
+                   + (f'  imports {", ".join(r["heavy_imports"])}' if r['heavy_imports'] else ''))
+    if json_file:
+        json.dump({'python': sys.version, 'runs': runs, 'interpreter_ms': round(baseline * 1000, 1),
+                   'commands': results}, json_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from typing import Any, Callable
+
+import profiling
+from configuration import CACHE_DIR
+
+
+class CacheMiss(LookupError):
+    """Raised in offline mode when a response isn't in the cache."""
+
+
+def text_key(text: str) -> str:
+    """Cache key for a text, e.g. to tokenize. A hash, so that long texts don't bloat the cache's index."""
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+class ResponseCache:
+    """
+    On-disk cache of jisho.org responses, keyed by endpoint and query.
+    Entries expire after `ttl` seconds; once the cache grows past `max_bytes`, the least recently used are evicted.
+    """
+    PATH = CACHE_DIR / 'responses.db'
+    TTL = 30 * 24 * 60 * 60  # 30 days
+    MAX_BYTES = 64 * 1024 * 1024
+
+    def __init__(self, path=None, ttl: float = TTL, max_bytes: int = MAX_BYTES, offline: bool = False):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self._size: int | None = None
+        self._lock = threading.Lock()
+
+        path = path or ResponseCache.PATH
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # several processes may be looking words up at once, so wait for each other's writes
+        self._db = sqlite3.connect(path, timeout=60, check_same_thread=False, isolation_level=None)
+        self._db.executescript("""
+            PRAGMA journal_mode = WAL;
+            CREATE TABLE IF NOT EXISTS responses (
+                endpoint TEXT NOT NULL,
+                query TEXT NOT NULL,
+                body TEXT,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL,
+                PRIMARY KEY (endpoint, query)
+            );
+            CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed);
+        """)
+
+    def get(self, endpoint: str, query: str) -> tuple[bool, str | None]:
+        """Returns whether there is a usable entry, and its body. A None body means jisho found nothing."""
+        now = time.time()
+        with self._lock:
+            row = self._db.execute('SELECT body, created FROM responses WHERE endpoint = ? AND query = ?',
+                                   (endpoint, query)).fetchone()
+            if row is None:
+                return False, None
+            # stale entries are still better than nothing when we can't go online
+            if not self.offline and now - row[1] > self.ttl:
+                return False, None
+            self._db.execute('UPDATE responses SET accessed = ? WHERE endpoint = ? AND query = ?',
+                             (now, endpoint, query))
+        return True, row[0]
+
+    def put(self, endpoint: str, query: str, body: str | None):
+        now = time.time()
+        size = len(endpoint) + len(query) + len(body or '')
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)',
+                             (endpoint, query, body, size, now, now))
+            if self._size is None:
+                self._size = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+            else:
+                self._size += size
+            if self._size > self.max_bytes:
+                self._evict(now)
+
+    def _evict(self, now: float):
+        """Drop expired entries, then least recently used ones until the cache is back under 3/4 of its cap."""
+        self._db.execute('DELETE FROM responses WHERE created < ?', (now - self.ttl,))
+        self._size = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        target = self.max_bytes * 3 // 4
+        for key, size in self._db.execute('SELECT rowid, size FROM responses ORDER BY accessed').fetchall():
+            if self._size <= target:
+                break
+            self._db.execute('DELETE FROM responses WHERE rowid = ?', (key,))
+            self._size -= size
+
+    def clear(self):
+        with self._lock:
+            self._db.execute('DELETE FROM responses')
+            self._size = 0
+
+    def wrap(self, endpoint: str, request: Callable[[str], Any], model,
+             key: Callable[[str], str] = None) -> Callable[[str], Any]:
+        """
+        Returns a version of a jisho_api request function which goes through the cache.
+        `model` is the pydantic response type, used to restore cached bodies.
+        `key` turns queries into cache keys, e.g. `text_key` for long texts. By default, queries are their own keys.
+        """
+        def cached(query: str):
+            query_key = key(query) if key else query
+            with profiling.stage('response cache'):
+                hit, body = self.get(endpoint, query_key)
+            if hit:
+                profiling.count('cache hits')
+                profiling.count('bytes read', len(body or ''))
+                with profiling.stage('response decode'):
+                    return model.parse_raw(body) if body is not None else None
+            profiling.count('cache misses')
+            if self.offline:
+                raise CacheMiss(f'"{query}" is not cached')
+            response = request(query)
+            with profiling.stage('response encode'):
+                body = response.json() if response is not None else None
+            with profiling.stage('response cache'):
+                self.put(endpoint, query_key, body)
+            profiling.count('bytes written', len(body or ''))
+            return response
+        return cached
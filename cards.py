@@ -0,0 +1,101 @@
+from __future__ import annotations
+
+import json
+from typing import TYPE_CHECKING, NamedTuple
+
+if TYPE_CHECKING:
+    from jisho_api.sentence.cfg import SentenceConfig
+    from jisho_api.word.cfg import WordConfig
+
+
+class Form(NamedTuple):
+    """One way of writing a word. `word` is None for kana-only words."""
+    word: str | None
+    reading: str | None
+
+
+class Sense(NamedTuple):
+    english_definitions: list[str]
+    parts_of_speech: list[str | None]
+
+
+class Card:
+    """
+    The parts of a jisho.org word entry that cards are made from.
+    Has the same attribute names as `WordConfig`, so either can be formatted, but leaves out links, attribution
+    and the rest of each sense. The full entry can be kept alongside as `payload`, for fields that might need it.
+    """
+    __slots__ = ('slug', 'japanese', 'senses', 'jlpt', 'tags', 'payload')
+
+    def __init__(self, slug: str, japanese: list[Form], senses: list[Sense], jlpt: list[str] = None,
+                 tags: list[str] = None, payload: dict = None):
+        self.slug = slug
+        self.japanese = japanese
+        self.senses = senses
+        self.jlpt = jlpt or []
+        self.tags = tags or []
+        self.payload = payload
+
+    def __repr__(self):
+        return f'Card({self.slug!r})'
+
+    @classmethod
+    def from_word(cls, word: WordConfig, keep_payload: bool = False) -> Card:
+        return cls(word.slug,
+                   [Form(j.word, j.reading) for j in word.japanese],
+                   [Sense(list(s.english_definitions), list(s.parts_of_speech)) for s in word.senses],
+                   list(word.jlpt), list(word.tags),
+                   json.loads(word.json()) if keep_payload else None)
+
+    @classmethod
+    def of(cls, card: Card | WordConfig, keep_payload: bool = False) -> Card:
+        """The card itself, or the card for a full word entry."""
+        return card if isinstance(card, Card) else cls.from_word(card, keep_payload)
+
+    def word(self) -> WordConfig:
+        """The full word entry. Only available if the payload was kept."""
+        if self.payload is None:
+            raise ValueError(f'Full entry for "{self.slug}" was not kept.')
+        from jisho_api.word.cfg import WordConfig
+        return WordConfig.parse_obj(self.payload)
+
+    def to_json(self) -> str:
+        """Compact form for storage, as a JSON array rather than an object with field names."""
+        data = [self.slug, self.japanese, self.senses, self.jlpt, self.tags]
+        if self.payload is not None:
+            data.append(self.payload)
+        return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+
+    @classmethod
+    def from_json(cls, data: str) -> Card:
+        """Restore a card from `to_json`, or from a stored `WordConfig` (an object rather than an array)."""
+        data = json.loads(data)
+        if isinstance(data, dict):
+            return cls(data['slug'],
+                       [Form(j['word'], j['reading']) for j in data['japanese']],
+                       [Sense(s['english_definitions'], s['parts_of_speech']) for s in data['senses']],
+                       data['jlpt'], data['tags'])
+        slug, japanese, senses, jlpt, tags, *payload = data
+        return cls(slug, [Form(*j) for j in japanese], [Sense(*s) for s in senses], jlpt, tags,
+                   payload[0] if payload else None)
+
+
+class Example(NamedTuple):
+    """An example sentence, as kept for a card."""
+    japanese: str
+    en_translation: str
+
+    @classmethod
+    def of(cls, sentence: Example | SentenceConfig) -> Example:
+        return sentence if isinstance(sentence, Example) else cls(sentence.japanese, sentence.en_translation)
+
+    def to_json(self) -> str:
+        return json.dumps(self, ensure_ascii=False, separators=(',', ':'))
+
+    @classmethod
+    def from_json(cls, data: str) -> Example:
+        """Restore an example from `to_json`, or from a stored `SentenceConfig`."""
+        data = json.loads(data)
+        if isinstance(data, dict):
+            return cls(data['japanese'], data['en_translation'])
+        return cls(*data)
@@ -1,85 +1,860 @@
+from __future__ import annotations
+
+import hashlib
+import json
 import os
-from typing import Self
+import sqlite3
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Any, Callable, Iterable, Iterator, Self, TextIO
 
-import jsonpickle
 from pathlib import Path
 
-from jisho_api.sentence.cfg import SentenceConfig
-from jisho_api.word.cfg import WordConfig
+import profiling
+from cards import Card, Example
+
+# jsonpickle and jisho_api (pydantic) are slow to import, so they're only imported where they're needed
+if TYPE_CHECKING:
+    from jisho_api.sentence.cfg import SentenceConfig
+    from jisho_api.word.cfg import WordConfig
 
 CACHE_DIR: Path = Path.home() / '.nomikomi'
 
+# set while serving (see `serving`): the examples and config loaded by one command are kept for the next,
+# and only read again once they've been changed by another process
+keep_warm = False
+
+_MMAP_SIZE = 1 << 30
+_CHUNK_SIZE = 1 << 20  # characters of a legacy file read at a time
+_BUSY_TIMEOUT = 60  # seconds to wait for another process's write to finish
+_LOOKUP_SIZE = 500  # words looked up in the database per query
+
+
+@contextmanager
+def _locked(path: Path, shared: bool = False) -> Iterator[None]:
+    """
+    Advisory lock on a file in the cache directory, between processes (through a `.lock` file next to it).
+    Database connections hold it shared, since SQLite keeps their writes apart itself, and replacing or deleting
+    a whole file holds it exclusively. Not reentrant: don't take it exclusively while holding it in the same process.
+    """
+    try:
+        import fcntl
+    except ImportError:  # no advisory locks on Windows
+        yield
+        return
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path.with_suffix('.lock'), 'a') as file:
+        fcntl.flock(file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(file, fcntl.LOCK_UN)
+
+
+def _remove(*paths: Path):
+    """Delete files, along with SQLite's write-ahead log and shared memory files for them."""
+    for path in paths:
+        for file in [path, Path(f'{path}-wal'), Path(f'{path}-shm')]:
+            if os.path.isfile(file):
+                os.remove(file)
+
+
+def _is_empty(path: Path, table: str) -> bool:
+    """Whether a database's table has no rows. Opens the database directly, so it can be used under `_locked`."""
+    db = sqlite3.connect(path, timeout=_BUSY_TIMEOUT)
+    try:
+        return not db.execute(f'SELECT EXISTS (SELECT 1 FROM {table})').fetchone()[0]
+    except sqlite3.OperationalError:  # no such table
+        return True
+    finally:
+        db.close()
+
+
+def _statements(script: str) -> list[str]:
+    """Split a schema or migration into its statements. Their string literals mustn't contain `;`."""
+    return [s for s in script.split(';') if s.strip()]
+
+
+def _upgrade(db: sqlite3.Connection, schema: str, migrations: tuple[str, ...]):
+    """
+    Create a new database's tables, or run the migrations an older one hasn't had yet, holding the write lock
+    throughout so that processes opening it at the same time don't both do it.
+    `schema` is always up to date, so a new database starts at the latest user_version without any migrations.
+    """
+    db.isolation_level = None
+    try:
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            # another process may have upgraded it while this one waited for the lock
+            version = db.execute('PRAGMA user_version').fetchone()[0]
+            if not db.execute('SELECT EXISTS (SELECT 1 FROM sqlite_master)').fetchone()[0]:
+                for statement in _statements(schema):
+                    db.execute(statement)
+            else:
+                for migration in migrations[version:]:
+                    for statement in _statements(migration):
+                        db.execute(statement)
+            db.execute(f'PRAGMA user_version = {len(migrations)}')
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+    finally:
+        db.isolation_level = ''
+
+
+@contextmanager
+def _database(path: Path, schema: str, migrations: tuple[str, ...] = ()) -> Iterator[sqlite3.Connection]:
+    """
+    Open a SQLite database, making sure its tables exist. Changes are committed together on exit.
+    `migrations` are scripts which bring databases created by older versions up to `schema`, run in order;
+    the database's user_version counts those it has had.
+    """
+    with _locked(path, shared=True):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        db = sqlite3.connect(path, timeout=_BUSY_TIMEOUT)
+        try:
+            # writes are appended to a write-ahead log, so a crash can't leave the database half written,
+            # and other processes can keep reading while one writes
+            db.execute('PRAGMA journal_mode = WAL')
+            # let SQLite memory-map the file, so reads come straight from the page cache instead of being copied
+            db.execute(f'PRAGMA mmap_size = {_MMAP_SIZE}')
+            if db.execute('PRAGMA user_version').fetchone()[0] < len(migrations):
+                _upgrade(db, schema, migrations)
+            # tables and indices added without a migration
+            db.executescript(schema)
+            with db:
+                yield db
+        finally:
+            db.close()
+
+
+def _changes(stored: dict, current: dict) -> tuple[dict, list]:
+    """Items which were added or replaced since loading, and keys which were removed."""
+    upserts = {key: value for key, value in current.items() if stored.get(key) is not value}
+    deletes = [key for key in stored if key not in current]
+    return upserts, deletes
+
+
+def _last_stamp(cls) -> int | None:
+    """
+    Stamp of the latest change to a database (see `_stamp`), which serves as its version. None if there is no database.
+    """
+    if not os.path.isfile(cls.PATH):
+        return None
+    with _database(cls.PATH, cls.SCHEMA, cls.MIGRATIONS) as db:
+        row = db.execute("SELECT value FROM meta WHERE key = 'stamp'").fetchone()
+    return row[0] if row else 0
+
+
+def _stamp(db: sqlite3.Connection) -> tuple[int, int]:
+    """
+    Start a write to a database, taking its write lock, and give it a new modification stamp for the rows it writes.
+    Stamps are taken under the lock, so they increase in the order writes are committed, and once a stamp has been
+    read, every later write gets a higher one. They follow the clock, so a recreated database doesn't repeat them.
+    Returns the previous stamp, and the new one.
+    """
+    db.execute('BEGIN IMMEDIATE')
+    row = db.execute("SELECT value FROM meta WHERE key = 'stamp'").fetchone()
+    previous = row[0] if row else 0
+    now = max(time.time_ns(), previous + 1)
+    db.execute("INSERT OR REPLACE INTO meta VALUES ('stamp', ?)", (now,))
+    return previous, now
+
+
+def _kept(cls, version: int | None):
+    """The instance kept from an earlier command while serving, if it's still the same as the database."""
+    warm = cls._warm
+    if not keep_warm or warm is None or version is None or warm._version != version:
+        return None
+    # drop it if a command changed it without saving
+    upserts, deletes = _changes(warm._stored, warm._current())
+    return None if upserts or deletes else warm
+
+
+def _read_pickle(path: Path):
+    """Decode an object from a jsonpickle file."""
+    import jsonpickle
+    with open(path, 'r') as file:
+        data = file.read()
+    profiling.count('bytes read', len(data))
+    with profiling.stage('jsonpickle decode'):
+        return jsonpickle.decode(data)
+
+
+def _write_pickle(path: Path, obj):
+    """
+    Encode an object to a jsonpickle file. It's written to a temporary file first and then renamed over the old one,
+    so the file is never left half written.
+    """
+    import jsonpickle
+    with profiling.stage('jsonpickle encode'):
+        data = jsonpickle.encode(obj)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    file = tempfile.NamedTemporaryFile('w', dir=path.parent, prefix=f'.{path.name}.', delete=False)
+    try:
+        with file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(file.name, path)
+    except BaseException:
+        os.remove(file.name)
+        raise
+    profiling.count('bytes written', len(data))
+
+
+class _JsonStream:
+    """Reads JSON values from a file one at a time, holding no more of its text than a value and a chunk."""
+
+    def __init__(self, file: TextIO):
+        self.file = file
+        self.text = ''
+        self.pos = 0
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self) -> bool:
+        chunk = self.file.read(_CHUNK_SIZE)
+        if not chunk:
+            return False
+        profiling.count('bytes read', len(chunk))
+        self.text = self.text[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Skip whitespace, and return the next character ('' at the end of the file)."""
+        while True:
+            while self.pos < len(self.text) and self.text[self.pos] in ' \t\n\r':
+                self.pos += 1
+            if self.pos < len(self.text) or not self._fill():
+                return self.text[self.pos:self.pos + 1]
+
+    def expect(self, chars: str) -> str:
+        c = self.peek()
+        if not c or c not in chars:
+            raise ValueError(f'Expected one of {chars!r} at {c!r}')
+        self.pos += 1
+        return c
+
+    def value(self) -> tuple[Any, str]:
+        """The next value, and its text."""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.text, self.pos)
+            except json.JSONDecodeError:
+                # the value is cut off at the end of the chunk, unless the file has ended
+                if not self._fill():
+                    raise
+                continue
+            # a number might carry on into the next chunk
+            if end < len(self.text) or not self._fill():
+                start, self.pos = self.pos, end
+                return value, self.text[start:end]
+
+
+def _iter_pickled(path: Path, key: str) -> Iterator[tuple[int | str, Any]]:
+    """
+    Stream the entries of the list or dict under `key` in a jsonpickle file, with their indices or keys.
+    Each entry is restored by itself, so only one is in memory at a time, however large the file is.
+    Raises ValueError for files which can't be read this way, e.g. if entries refer to objects in other entries.
+    """
+    import jsonpickle
+    unpickler = jsonpickle.Unpickler()
+    restore = profiling.timed('jsonpickle decode', lambda obj: unpickler.restore(obj, reset=True))
+    with open(path, 'r', encoding='utf-8') as file:
+        stream = _JsonStream(file)
+        stream.expect('{')
+        while stream.peek() != '}':
+            name, _ = stream.value()
+            stream.expect(':')
+            if name != key:
+                stream.value()
+            else:
+                closing = ']' if stream.expect('[{') == '[' else '}'
+                i = 0
+                while stream.peek() != closing:
+                    entry = i
+                    if closing == '}':
+                        entry, _ = stream.value()
+                        stream.expect(':')
+                    obj, text = stream.value()
+                    if '"py/id"' in text:
+                        raise ValueError(f'Entry {entry!r} refers to objects outside of it')
+                    yield entry, restore(obj)
+                    i += 1
+                    if stream.peek() == ',':
+                        stream.expect(',')
+                stream.expect(closing)
+            if stream.peek() == ',':
+                stream.expect(',')
+
+
+def _migrate(legacy_path: Path, cls):
+    """
+    Load a jsonpickle file from before the SQLite backend, write its contents to the database and keep a backup.
+    Processes starting meanwhile wait for the migration to finish, rather than reading a half migrated database.
+    """
+    if not os.path.isfile(legacy_path):
+        return
+    # a lock of its own, since saving takes the database's lock (shared), and locks aren't reentrant
+    with _locked(legacy_path.with_name(f'{legacy_path.stem}-migration')):
+        # another process may have migrated it while this one waited
+        if not os.path.isfile(legacy_path) or os.path.isfile(cls.PATH):
+            return
+        try:
+            # entries are slimmed down as they're read, so the full ones are never all in memory at once
+            migrated = cls.from_legacy(_iter_pickled(legacy_path, cls.LEGACY_KEY))
+        except ValueError:
+            legacy = _read_pickle(legacy_path)
+            migrated = cls(**{key: value for key, value in legacy.__dict__.items() if not key.startswith('_')})
+        migrated.save()
+        os.replace(legacy_path, legacy_path.with_suffix('.json.bak'))
+
 
 class Examples:
-    PATH = CACHE_DIR / 'examples.json'
+    PATH = CACHE_DIR / 'examples.db'
+    LEGACY_PATH = CACHE_DIR / 'examples.json'
+    LEGACY_KEY = 'examples'
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS examples (
+            slug TEXT PRIMARY KEY,
+            data TEXT NOT NULL,
+            modified INTEGER NOT NULL DEFAULT 0
+        );
+        -- when examples were removed, so that incremental exports also pick up their cards
+        CREATE TABLE IF NOT EXISTS removed (
+            slug TEXT PRIMARY KEY,
+            modified INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value
+        );
+    """
+    MIGRATIONS = (
+        'ALTER TABLE examples ADD COLUMN modified INTEGER NOT NULL DEFAULT 0',
+    )
 
-    def __init__(self, examples: dict[str, SentenceConfig] = None):
+    _warm: Examples | None = None
+
+    def __init__(self, examples: dict[str, Example | SentenceConfig] = None):
         self.examples = examples or {}
+        self._stored: dict[str, Example | SentenceConfig] = {}
+        self._version: int | None = None
+
+    def _current(self) -> dict[str, Example | SentenceConfig]:
+        return self.examples
+
+    @classmethod
+    def from_legacy(cls, entries: Iterator[tuple[str, SentenceConfig]]) -> Self:
+        """Examples from the entries of a legacy examples file (see `_iter_pickled`)."""
+        return cls({slug: Example.of(sentence) for slug, sentence in entries})
 
     def save(self):
-        path = Examples.PATH
-        if self.examples:
-            with open(path, 'w') as file:
-                file.write(jsonpickle.encode(self, warn=True))
-        elif os.path.isfile(path):
-            os.remove(path)
+        """Write examples which were added, replaced or removed since loading."""
+        upserts, deletes = _changes(self._stored, self.examples)
+        if upserts or deletes:
+            with _database(Examples.PATH, Examples.SCHEMA, Examples.MIGRATIONS) as db:
+                previous, now = _stamp(db)
+                db.executemany('INSERT OR REPLACE INTO examples (slug, data, modified) VALUES (?, ?, ?)',
+                               [(slug, Example.of(e).to_json(), now) for slug, e in upserts.items()])
+                db.executemany('DELETE FROM removed WHERE slug = ?', [(slug,) for slug in upserts])
+                db.executemany('DELETE FROM examples WHERE slug = ?', [(slug,) for slug in deletes])
+                db.executemany('INSERT OR REPLACE INTO removed VALUES (?, ?)', [(slug, now) for slug in deletes])
+                # unless someone else changed the database since loading, this is still the same as it
+                self._version = now if previous == self._version else None
+        self._stored = dict(self.examples)
+
+        # if there are no examples (even from other processes), don't leave an empty database around
+        if not self.examples:
+            Examples.delete_file(only_if_empty=True)
 
     @staticmethod
-    def delete_file():
-        if os.path.isfile(Examples.PATH):
-            os.remove(Examples.PATH)
+    def delete_file(only_if_empty: bool = False):
+        with _locked(Examples.PATH):
+            if only_if_empty and os.path.isfile(Examples.PATH) and not _is_empty(Examples.PATH, 'examples'):
+                return
+            _remove(Examples.PATH, Examples.LEGACY_PATH)
 
     @classmethod
     def get(cls) -> Self:
-        """Load config object. Generates default configuration if no config file exists."""
-        # If there is no config file, generate a config object with default values
+        """Load examples object. Generates empty object if no examples database exists."""
+        _migrate(cls.LEGACY_PATH, cls)
+        # If there is no database, generate an empty examples object
         if not os.path.isfile(cls.PATH):
             return cls()
-        # Otherwise load from file
-        with open(cls.PATH, 'r') as file:
-            return jsonpickle.decode(file.read())
+        version = _last_stamp(cls)
+        if warm := _kept(cls, version):
+            return warm
+        # Otherwise load from database
+        with _database(cls.PATH, cls.SCHEMA, cls.MIGRATIONS) as db, profiling.stage('example decode'):
+            result = cls({slug: Example.from_json(data)
+                          for slug, data in db.execute('SELECT slug, data FROM examples')})
+        result._stored = dict(result.examples)
+        result._version = version
+        if keep_warm:
+            Examples._warm = result
+        return result
+
+    @classmethod
+    def last_stamp(cls) -> int:
+        """Stamp of the latest change to the examples. Anything changed later gets a higher one."""
+        return _last_stamp(cls) or 0
+
+    @classmethod
+    def changed_since(cls, since: int) -> set[str]:
+        """Slugs of the cards whose example was added, replaced or removed after the given modification stamp."""
+        _migrate(cls.LEGACY_PATH, cls)
+        if not os.path.isfile(cls.PATH):
+            return set()
+        with _database(cls.PATH, cls.SCHEMA, cls.MIGRATIONS) as db:
+            return {slug for slug, in db.execute('SELECT slug FROM examples WHERE modified > ? '
+                                                 'UNION SELECT slug FROM removed WHERE modified > ?', (since, since))}
+
+
+def card_key(card: Card | WordConfig) -> str:
+    """Canonical identity of a card. Slugs are unique per jisho.org entry, so duplicates share one."""
+    return card.slug
+
+
+def _written(card: Card) -> str:
+    return card.japanese[0].word or card.japanese[0].reading
+
+
+def _forms(card: Card) -> set[str]:
+    """Every written form and reading of a card."""
+    return {form for j in card.japanese for form in j if form}
+
+
+def _chunks(items: list, size: int = _LOOKUP_SIZE) -> Iterator[list]:
+    """Items in pieces small enough to pass as the parameters of one query."""
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _placeholders(items: list) -> str:
+    return ', '.join('?' * len(items))
+
+
+def _sort_key(card: Card) -> str:
+    return card.japanese[0].reading or card.japanese[0].word
+
+
+def _select(db: sqlite3.Connection, columns: str, since: int = None, slugs: set[str] = ()) -> sqlite3.Cursor:
+    """Columns of the cards selected by `Library.iter_cards`, joined with their rendered rows, in sorted order."""
+    query = f'SELECT {columns} FROM cards LEFT JOIN rendered ON rendered.slug = cards.slug'
+    if since is None:
+        return db.execute(f'{query} ORDER BY cards.sort_key, cards.slug')
+    db.execute('CREATE TEMP TABLE IF NOT EXISTS selected (slug TEXT PRIMARY KEY)')
+    db.executemany('INSERT OR IGNORE INTO selected VALUES (?)', [(slug,) for slug in slugs])
+    return db.execute(f'{query} WHERE cards.modified > ? OR cards.slug IN selected '
+                      f'ORDER BY cards.sort_key, cards.slug', (since,))
+
+
+# SQL for the written forms and readings of every card, with its slug, from its stored data
+# (pairs in an array, or objects for full word entries)
+_FORMS = """
+    SELECT DISTINCT f.value, cards.slug
+    FROM cards, json_each(cards.data, CASE json_type(cards.data) WHEN 'array' THEN '$[1]' ELSE '$.japanese' END) AS j,
+        json_each(j.value) AS f
+    WHERE f.key IN (0, 1, 'word', 'reading') AND f.value != ''
+"""
+
+# SQL for the first JLPT level or tag of a card, from its stored data (an array, or an object for full word entries)
+_GROUPS = {
+    'jlpt': "json_extract(cards.data, CASE json_type(cards.data) WHEN 'array' THEN '$[3][0]' ELSE '$.jlpt[0]' END)",
+    'tag': "json_extract(cards.data, CASE json_type(cards.data) WHEN 'array' THEN '$[4][0]' ELSE '$.tags[0]' END)",
+}
+
+
+def _invalidate_rendered(db: sqlite3.Connection, fingerprint: str):
+    row = db.execute("SELECT value FROM meta WHERE key = 'fingerprint'").fetchone()
+    if row is None or row[0] != fingerprint:
+        db.execute('DELETE FROM rendered')
+        db.execute("INSERT OR REPLACE INTO meta VALUES ('fingerprint', ?)", (fingerprint,))
 
 
 class Library:
-    PATH = CACHE_DIR / 'library.json'
+    PATH = CACHE_DIR / 'library.db'
+    LEGACY_PATH = CACHE_DIR / 'library.json'
+    LEGACY_KEY = 'cards'
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS cards (
+            slug TEXT PRIMARY KEY,
+            word TEXT NOT NULL,
+            sort_key TEXT NOT NULL,
+            data TEXT NOT NULL,
+            modified INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS cards_word ON cards (word);
+        CREATE INDEX IF NOT EXISTS cards_modified ON cards (modified);
+        -- covers listing cards in order, so that doesn't touch the card data at all
+        DROP INDEX IF EXISTS cards_sort_key;
+        CREATE INDEX IF NOT EXISTS cards_order ON cards (sort_key, slug, word);
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value
+        );
+        -- every written form and reading of each card, to find cards by any of them
+        CREATE TABLE IF NOT EXISTS forms (
+            form TEXT NOT NULL,
+            slug TEXT NOT NULL,
+            PRIMARY KEY (form, slug)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS forms_slug ON forms (slug);
+        -- export rows rendered for each card, with the card stamp and example they were rendered from
+        CREATE TABLE IF NOT EXISTS rendered (
+            slug TEXT PRIMARY KEY,
+            modified INTEGER NOT NULL,
+            example TEXT,
+            row TEXT NOT NULL
+        );
+    """
+    MIGRATIONS = (
+        # cards from before modification stamps count as older than any export
+        'ALTER TABLE cards ADD COLUMN modified INTEGER NOT NULL DEFAULT 0; '
+        'CREATE INDEX cards_modified ON cards (modified)',
+        'CREATE TABLE forms (form TEXT NOT NULL, slug TEXT NOT NULL, PRIMARY KEY (form, slug)) WITHOUT ROWID; '
+        'CREATE INDEX forms_slug ON forms (slug); '
+        f'INSERT OR IGNORE INTO forms {_FORMS}',
+    )
+
+    def __init__(self, cards: list[Card | WordConfig] = None):
+        """
+        The library as stored, along with cards added and removed since, which `save` writes.
+        Cards are only read from the database as they're looked up, so nothing here grows with the library's size.
+        """
+        # full word entries (e.g. from older library files) are slimmed down to cards
+        self._added: dict[str, Card] = {card_key(c): Card.of(c) for c in cards or []}
+        self._removed: set[str] = set()
+
+    @classmethod
+    def from_legacy(cls, entries: Iterator[tuple[int, WordConfig]]) -> Self:
+        """Library of the entries of a legacy library file (see `_iter_pickled`)."""
+        return cls([Card.of(word) for _, word in entries])
+
+    def _query(self, query: str, words: list[str]) -> list[tuple]:
+        """Rows of a query on the database, run for the words a chunk at a time. `{}` in it stands for a chunk."""
+        _migrate(Library.LEGACY_PATH, Library)
+        if not words or not os.path.isfile(Library.PATH):
+            return []
+        with _database(Library.PATH, Library.SCHEMA, Library.MIGRATIONS) as db:
+            return [row for chunk in _chunks(words)
+                    for row in db.execute(query.replace('{}', _placeholders(chunk)), chunk * query.count('{}'))]
+
+    def known(self, words: Iterable[str]) -> set[str]:
+        """Those of the words which match a card's slug or primary written form. Doesn't decode any cards."""
+        words = list(dict.fromkeys(words))
+        rows = self._query('SELECT slug, word FROM cards WHERE slug IN ({}) OR word IN ({})', words)
+        rows = [row for row in rows if row[0] not in self._removed and row[0] not in self._added]
+        rows += [(key, _written(c)) for key, c in self._added.items()]
+        matched = {form for row in rows for form in row}
+        return {w for w in words if w in matched}
+
+    def __contains__(self, item: Card | WordConfig | str) -> bool:
+        """Whether a card, or a word matching a card's slug or primary written form, is in the library."""
+        return bool(self.known([item if isinstance(item, str) else card_key(item)]))
+
+    def lookup(self, words: Iterable[str]) -> dict[str, list[Card]]:
+        """
+        Cards matching each of the words, looked up in the database's indices rather than by scanning it,
+        and decoding only the cards which match.
+        Cards with a word as their primary written form come first; failing that, the card with it as its slug,
+        and failing that, every card with it as any of its written forms or readings.
+        """
+        words = list(dict.fromkeys(words))
+        rows = self._query('SELECT slug, data FROM cards '
+                            'WHERE slug IN ({}) OR slug IN (SELECT slug FROM forms WHERE form IN ({}))', words)
+        with profiling.stage('card decode'):
+            cards = {key: Card.from_json(data) for key, data in rows if key not in self._removed}
+        cards.update(self._added)
+        # indices of the candidates, built once, so each word is answered with lookups rather than a scan
+        written: dict[str, list[Card]] = {}
+        forms: dict[str, list[Card]] = {}
+        for card in cards.values():
+            written.setdefault(_written(card), []).append(card)
+            for form in _forms(card):
+                forms.setdefault(form, []).append(card)
+        return {w: list(written.get(w) or [c for c in [cards.get(w)] if c] or forms.get(w, [])) for w in words}
+
+    def find(self, word: str) -> list[Card]:
+        """Cards matching a word (see `lookup`)."""
+        return self.lookup([word])[word]
+
+    def add(self, *cards: Card | WordConfig) -> list[Card]:
+        """Add cards, except those already in the library. Returns those which were added."""
+        known = self.known(card_key(c) for c in cards)
+        added = []
+        for card in cards:
+            if card_key(card) not in known:
+                card = Card.of(card)
+                self._added[card_key(card)] = card
+                known.add(card_key(card))
+                added.append(card)
+        return added
+
+    def remove(self, *cards: Card):
+        """Remove cards from the library."""
+        for card in cards:
+            self._added.pop(card_key(card), None)
+            self._removed.add(card_key(card))
+
+    def save(self):
+        """Write the cards which were added or removed, touching only their rows."""
+        if not self._added and not self._removed:
+            return
+        with profiling.stage('card encode'):
+            rows = [(key, _written(c), _sort_key(c), c.to_json()) for key, c in self._added.items()]
+        if profiling.current:
+            profiling.count('bytes written', sum(len(row[3]) for row in rows))
+        changed = [(key,) for key in self._removed | self._added.keys()]
+        with _database(Library.PATH, Library.SCHEMA, Library.MIGRATIONS) as db, profiling.stage('database write'):
+            _, now = _stamp(db)
+            db.executemany('DELETE FROM forms WHERE slug = ?', changed)
+            db.executemany('DELETE FROM rendered WHERE slug = ?', [(key,) for key in self._removed])
+            db.executemany('DELETE FROM cards WHERE slug = ?', [(key,) for key in self._removed])
+            db.executemany('INSERT OR REPLACE INTO cards (slug, word, sort_key, data, modified) '
+                           'VALUES (?, ?, ?, ?, ?)', [(*row, now) for row in rows])
+            db.executemany('INSERT OR IGNORE INTO forms VALUES (?, ?)',
+                           [(form, key) for key, c in self._added.items() for form in _forms(c)])
+            empty = db.execute('SELECT NOT EXISTS (SELECT 1 FROM cards)').fetchone()[0]
+        self._added, self._removed = {}, set()
+
+        # if there are no cards (even from other processes), don't leave an empty database around
+        if empty:
+            Library.delete_file(only_if_empty=True)
+
+    @staticmethod
+    def delete_file(only_if_empty: bool = False):
+        with _locked(Library.PATH):
+            if only_if_empty and os.path.isfile(Library.PATH) and not _is_empty(Library.PATH, 'cards'):
+                return
+            _remove(Library.PATH, Library.LEGACY_PATH)
+
+    @classmethod
+    def get(cls) -> Self:
+        """Open the library. Cards are read as they're looked up, so this doesn't read any."""
+        _migrate(cls.LEGACY_PATH, cls)
+        return cls()
+
+    @classmethod
+    def iter_cards(cls, since: int = None, slugs: set[str] = ()) -> Iterator[Card]:
+        """
+        Stream cards from the database in sorted order, without loading the whole library.
+        With `since`, only cards modified after that stamp, along with any whose slugs are given.
+        """
+        _migrate(cls.LEGACY_PATH, cls)
+        if not os.path.isfile(cls.PATH):
+            return
+        decode = profiling.timed('card decode', Card.from_json)
+        measuring = profiling.current is not None
+        with _database(cls.PATH, cls.SCHEMA, cls.MIGRATIONS) as db:
+            for data, in _select(db, 'cards.data', since, slugs):
+                if measuring:
+                    profiling.count('bytes read', len(data))
+                yield decode(data)
+
+    @classmethod
+    def iter_rendered(cls, fingerprint: str, render: Callable[[list[str]], list[str]], examples: dict[str, Example],
+                      since: int = None, slugs: set[str] = (), group: str = None,
+                      batch_size: int = 1000) -> Iterator[tuple[str | None, str]]:
+        """
+        Stream the export row of each card (as selected by `iter_cards`), in sorted order.
+        Rows rendered by earlier exports are reused while the card, its example and the config `fingerprint`
+        are unchanged, without decoding the card. The other cards of each batch are rendered together, by passing
+        their stored data to `render`, and their rows are kept for next time.
+        Each row comes with the card's first JLPT level or tag, if `group` is 'jlpt' or 'tag'.
+        """
+        _migrate(cls.LEGACY_PATH, cls)
+        if not os.path.isfile(cls.PATH):
+            return
+        measuring = profiling.current is not None
+        # rendered rows are written on a second connection and committed a batch at a time, so other processes
+        # only wait for the write lock while a batch is written, rather than for the whole export
+        with _database(cls.PATH, cls.SCHEMA, cls.MIGRATIONS) as db, \
+                _database(cls.PATH, cls.SCHEMA, cls.MIGRATIONS) as writer:
+            with writer:
+                _invalidate_rendered(writer, fingerprint)
+            columns = ('cards.slug, cards.modified, cards.data, rendered.modified, rendered.example, rendered.row, '
+                       + _GROUPS.get(group, 'NULL'))
+            records = _select(db, columns, since, slugs)
+            while batch := records.fetchmany(batch_size):
+                rows, stale = [], []
+                for slug, modified, data, rendered_modified, rendered_example, row, key in batch:
+                    example = examples.get(slug)
+                    example = Example.of(example).to_json() if example else None
+                    if row is None or rendered_modified != modified or rendered_example != example:
+                        stale.append((len(rows), slug, modified, example, data))
+                    rows.append((key, row))
+                if measuring:
+                    profiling.count('rows reused', len(batch) - len(stale))
+                    profiling.count('bytes read', sum(len(data) for *_, data in stale))
+                if stale:
+                    rendered = render([data for *_, data in stale])
+                    for (i, slug, modified, example, _), row in zip(stale, rendered):
+                        rows[i] = (rows[i][0], row)
+                    with writer:
+                        writer.executemany('INSERT OR REPLACE INTO rendered VALUES (?, ?, ?, ?)',
+                                           [(slug, modified, example, row)
+                                            for (_, slug, modified, example, _), row in zip(stale, rendered)])
+                yield from rows
+
+    @classmethod
+    def invalidate_rendered(cls, fingerprint: str):
+        """Drop rendered export rows, if they were rendered with a different config fingerprint."""
+        if not os.path.isfile(cls.PATH):
+            return
+        with _database(cls.PATH, cls.SCHEMA, cls.MIGRATIONS) as db:
+            _invalidate_rendered(db, fingerprint)
+
+    @classmethod
+    def forms(cls) -> set[str]:
+        """Every written form and reading of every card, e.g. to tokenize text with. Doesn't decode any cards."""
+        _migrate(cls.LEGACY_PATH, cls)
+        if not os.path.isfile(cls.PATH):
+            return set()
+        with _database(cls.PATH, cls.SCHEMA, cls.MIGRATIONS) as db:
+            return {form for form, in db.execute('SELECT DISTINCT form FROM forms')}
+
+    @classmethod
+    def exported(cls) -> tuple[int, int] | None:
+        """
+        Stamps of the library and of the examples (see `last_stamp`) up to which cards and examples have been exported,
+        or None if the library never has been.
+        """
+        if not os.path.isfile(cls.PATH):
+            return None
+        with _database(cls.PATH, cls.SCHEMA, cls.MIGRATIONS) as db:
+            marks = dict(db.execute("SELECT key, value FROM meta WHERE key IN ('exported', 'examples exported')"))
+        if 'exported' not in marks:
+            return None
+        # exports by older versions marked both with the time they started
+        return marks['exported'], marks.get('examples exported', marks['exported'])
+
+    @classmethod
+    def mark_exported(cls, cards_up_to: int, examples_up_to: int):
+        """Record that every card and example modified up to the stamps has been exported."""
+        if not os.path.isfile(cls.PATH):
+            return
+        with _database(cls.PATH, cls.SCHEMA, cls.MIGRATIONS) as db:
+            # never backwards, e.g. past marks from before databases had stamps
+            db.executemany('INSERT INTO meta VALUES (?, ?) '
+                           'ON CONFLICT (key) DO UPDATE SET value = max(value, excluded.value)',
+                           [('exported', cards_up_to), ('examples exported', examples_up_to)])
+
+    @classmethod
+    def last_stamp(cls) -> int:
+        """Stamp of the latest change to the library. Anything changed later gets a higher one."""
+        return _last_stamp(cls) or 0
+
+    @classmethod
+    def entries(cls) -> list[tuple[str, str]]:
+        """The slug and primary written form of every card, in sorted order. Doesn't decode any cards."""
+        _migrate(cls.LEGACY_PATH, cls)
+        if not os.path.isfile(cls.PATH):
+            return []
+        with _database(cls.PATH, cls.SCHEMA, cls.MIGRATIONS) as db:
+            return db.execute('SELECT slug, word FROM cards ORDER BY sort_key, slug').fetchall()
+
+    @classmethod
+    def load(cls, slugs: list[str]) -> list[Card]:
+        """Decode only the cards with the given slugs, in the order given. Unknown slugs are skipped."""
+        if not slugs or not os.path.isfile(cls.PATH):
+            return []
+        with _database(cls.PATH, cls.SCHEMA, cls.MIGRATIONS) as db:
+            data = {slug: card for chunk in _chunks(slugs)
+                    for slug, card in db.execute(f'SELECT slug, data FROM cards WHERE slug IN ({_placeholders(chunk)})',
+                                                 chunk)}
+        return [Card.from_json(data[slug]) for slug in slugs if slug in data]
+
+    @classmethod
+    def discard(cls, slugs: list[str]):
+        """Delete cards straight from the database, without loading the library."""
+        if not slugs or not os.path.isfile(cls.PATH):
+            return
+        with _database(cls.PATH, cls.SCHEMA, cls.MIGRATIONS) as db:
+            db.executemany('DELETE FROM cards WHERE slug = ?', [(slug,) for slug in slugs])
+            db.executemany('DELETE FROM forms WHERE slug = ?', [(slug,) for slug in slugs])
+            db.executemany('DELETE FROM rendered WHERE slug = ?', [(slug,) for slug in slugs])
+            empty = db.execute('SELECT NOT EXISTS (SELECT 1 FROM cards)').fetchone()[0]
+        if empty:
+            Library.delete_file(only_if_empty=True)
+
+    @classmethod
+    def compact(cls) -> int:
+        """Rewrite cards still stored as full word entries in the compact card format. Returns how many were."""
+        _migrate(cls.LEGACY_PATH, cls)
+        if not os.path.isfile(cls.PATH):
+            return 0
+        with _database(cls.PATH, cls.SCHEMA, cls.MIGRATIONS) as db:
+            rows = db.execute("SELECT slug, data FROM cards WHERE data LIKE '{%'").fetchall()
+            db.executemany('UPDATE cards SET data = ? WHERE slug = ?',
+                           [(Card.from_json(data).to_json(), slug) for slug, data in rows])
+        if rows:
+            # give the freed space back to the file system
+            db = sqlite3.connect(cls.PATH, timeout=_BUSY_TIMEOUT)
+            db.execute('VACUUM')
+            db.close()
+        return len(rows)
 
-    def __init__(self, cards: list[WordConfig] = None):
-        self.cards = cards or []
+    @classmethod
+    def count(cls, since: int = None, slugs: set[str] = ()) -> int:
+        """Number of cards, or of those `iter_cards` would select with `since`."""
+        _migrate(cls.LEGACY_PATH, cls)
+        if not os.path.isfile(cls.PATH):
+            return 0
+        with _database(cls.PATH, cls.SCHEMA, cls.MIGRATIONS) as db:
+            if since is None:
+                return db.execute('SELECT COUNT(*) FROM cards').fetchone()[0]
+            return _select(db, 'COUNT(*)', since, slugs).fetchone()[0]
+
+
+class BatchProgress:
+    """How far into each input file batch runs have got, so that interrupted runs can resume."""
+    PATH = CACHE_DIR / 'batch.json'
+
+    def __init__(self, files: dict[str, tuple[int, int]] = None):
+        # path -> (modification time of the file when last read, byte offset reached)
+        self.files = files or {}
+        # the entries this run changed, which are all it writes back
+        self._updated: dict[str, tuple[int, int]] = {}
+
+    def __getstate__(self):
+        return {'files': self.files}
+
+    def offset(self, path: str) -> int:
+        """Where to resume reading a file. Starts over if the file has been modified since."""
+        mtime, offset = self.files.get(os.path.abspath(path), (None, 0))
+        return offset if mtime == os.stat(path).st_mtime_ns else 0
+
+    def update(self, path: str, offset: int):
+        path = os.path.abspath(path)
+        self.files[path] = self._updated[path] = (os.stat(path).st_mtime_ns, offset)
 
     def save(self):
-        # sort cards
-        self.cards.sort(key=lambda x: (x.japanese[0].reading or x.japanese[0].word))
-
-        # remove duplicates (sorted so only need to check neighbors)
-        # can't use turning into set/dict, because WordConfig type. this is fine
-        to_remove: list[WordConfig] = []
-        for i in range(self.cards.__len__() - 1):
-            if self.cards[i] == self.cards[i + 1]:
-                to_remove.append(self.cards[i])
-        for c in to_remove:
-            self.cards.remove(c)
-
-        if self.cards:
-            with open(Library.PATH, 'w') as file:
-                file.write(jsonpickle.encode(self, warn=True))
-        # if there are no cards, don't bother writing an empty file, delete anything that's there
-        elif os.path.isfile(Library.PATH):
-            os.remove(Library.PATH)
+        """Write the entries this run changed, keeping those other runs have saved meanwhile."""
+        with _locked(BatchProgress.PATH):
+            saved = BatchProgress.get()
+            saved.files.update(self._updated)
+            _write_pickle(BatchProgress.PATH, saved)
+        self.files = saved.files
 
     @staticmethod
     def delete_file():
-        if os.path.isfile(Library.PATH):
-            os.remove(Library.PATH)
+        with _locked(BatchProgress.PATH):
+            _remove(BatchProgress.PATH)
 
     @classmethod
     def get(cls) -> Self:
-        """Load library object. Generates empty object if no library file exists."""
-        # If there is no config file, generate a default config object
+        """Load batch progress. Generates empty object if no progress file exists."""
         if not os.path.isfile(cls.PATH):
             return cls()
-        # Otherwise load from file
-        with open(cls.PATH, 'r') as file:
-            return jsonpickle.decode(file.read())
+        progress = _read_pickle(cls.PATH)
+        progress._updated = {}
+        return progress
 
 
 class Config:
@@ -112,29 +887,69 @@ class Config:
                     raise KeyError(f'Field "{f}" is not valid.')
             self._fields = fields
 
-    def __init__(self, header: HeaderConfig = HeaderConfig(), senses: int = 1):
+    # config files saved before this option existed don't have it, so they fall back to this
+    keep_payload = False
+
+    # while serving, the file (inode, mtime, size) the config kept from an earlier command was loaded from
+    _warm: tuple[tuple | None, Config] | None = None
+
+    def __init__(self, header: HeaderConfig = HeaderConfig(), senses: int = 1, keep_payload: bool = False):
         self.header = header
         self.senses = senses
+        self.keep_payload = keep_payload
 
     def save(self):
-        with open(Config.PATH, 'w') as file:
-            file.write(jsonpickle.encode(self))
+        """Write the config. To change it, load and save it with `edit`, so that changes made meanwhile aren't lost."""
+        _write_pickle(Config.PATH, self)
+        # rows rendered for export under the old settings won't be used again
+        Library.invalidate_rendered(self.fingerprint())
+
+    @classmethod
+    @contextmanager
+    def edit(cls) -> Iterator[Self]:
+        """
+        Load the config to change it, and save it afterwards, holding the config lock throughout
+        so that other processes can't change it in between. Nothing is saved if an exception is raised.
+        """
+        with _locked(cls.PATH):
+            # a copy of its own, so that the config kept while serving isn't changed if this fails
+            config = cls._load()
+            yield config
+            config.save()
+
+    def fingerprint(self) -> str:
+        """Hash of the settings which export rows are rendered from."""
+        settings = json.dumps([list(self.header.fields), self.senses])
+        return hashlib.sha1(settings.encode()).hexdigest()
 
     def __str__(self):
-        return f'header: {self.header.__dict__},\nsenses: {self.senses}'
+        return f'header: {self.header.__dict__},\nsenses: {self.senses},\nkeep payload: {self.keep_payload}'
 
     @staticmethod
     def delete_file():
-        if os.path.isfile(Config.PATH):
-            os.remove(Config.PATH)
+        with _locked(Config.PATH):
+            _remove(Config.PATH)
 
     @classmethod
     def get(cls) -> Self:
         """Load config object. Generates default configuration if no config file exists."""
+        if not keep_warm:
+            return cls._load()
+        # the file is replaced whenever it's saved, so it's the same config as long as the file is
+        try:
+            stat = os.stat(cls.PATH)
+            key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            key = None
+        if cls._warm is None or cls._warm[0] != key:
+            cls._warm = (key, cls._load())
+        return cls._warm[1]
+
+    @classmethod
+    def _load(cls) -> Self:
         # If there is no config file, generate a default config object
         if not os.path.isfile(Config.PATH):
             return cls()
 
         # Otherwise load from file
-        with open(cls.PATH, 'r') as file:
-            return jsonpickle.decode(file.read())
+        return _read_pickle(cls.PATH)
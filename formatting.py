@@ -1,10 +1,21 @@
+from __future__ import annotations
+
 import csv
+import gzip
 import io
+import sys
+from contextlib import contextmanager
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator, TextIO
 
-from jisho_api.sentence.cfg import SentenceConfig
-from jisho_api.word.cfg import WordConfig
+import profiling
+from cards import Card
 from configuration import Config
 
+if TYPE_CHECKING:
+    from jisho_api.sentence.cfg import SentenceConfig
+    from jisho_api.word.cfg import WordConfig
+
 DEFINITION_SEPARATOR_STR = '; '
 TYPE_SEPARATOR_STR = ', '
 
@@ -14,46 +25,75 @@ def word_japanese(word: WordConfig) -> str:
     return word.japanese[0].word or word.japanese[0].reading
 
 
-def get_field(word: WordConfig, field: str, senses: int, example: SentenceConfig = None) -> str:
-    """Returns the correct field value for the supplied word."""
+def _vocab(word: WordConfig, example: SentenceConfig = None) -> str:
+    return word.japanese[0].word or word.japanese[0].reading
+
+
+def _kana(word: WordConfig, example: SentenceConfig = None) -> str:
+    return '' if not word.japanese[0].word else word.japanese[0].reading
+
+
+def _jlpt_level(word: WordConfig, example: SentenceConfig = None) -> str | None:
+    if word.jlpt:
+        return word.jlpt[0][-2:].upper()
+
+
+def _tags(word: WordConfig, example: SentenceConfig = None) -> str:
+    return ' '.join(word.tags)
+
+
+def _example(word: WordConfig, example: SentenceConfig = None) -> str:
+    return '' if not example else f'{example.japanese}<br>{example.en_translation}'
+
+
+def _sense_lines(attr: str, separator: str, senses: int) -> Callable[[WordConfig, SentenceConfig], str]:
+    """Extractor for a field with a line per sense, e.g. definitions or parts of speech."""
+    def extract(word: WordConfig, example: SentenceConfig = None) -> str:
+        sense_count = word.senses.__len__()
+        if senses == 1 or sense_count == 1:
+            return separator.join(getattr(word.senses[0], attr))
+        # sublist of senses list according to n sought
+        sublist = word.senses[:min(senses, sense_count - 1)] if senses > 0 else word.senses
+        # one string with <br> separating each sense's line
+        return '<br>'.join([f'({i}) ' + separator.join(getattr(line, attr)) for i, line in enumerate(sublist, 1)])
+    return extract
+
+
+def compile_field(field: str, senses: int) -> Callable[[WordConfig, SentenceConfig], str]:
+    """Returns a function which extracts the given field's value from a word, and optionally its example."""
     # check valid field name
     if field not in Config.HeaderConfig.VALID_FIELDS:
         raise ValueError(f'Field {field} not in {Config.HeaderConfig.VALID_FIELDS}')
 
-    # sublist of senses list according to n sought
-    sense_count = word.senses.__len__()
-    sublist = word.senses[:min(senses, sense_count - 1)] if senses > 0 else word.senses
-
     match field:
         case 'vocab':
-            return word.japanese[0].word or word.japanese[0].reading
+            return _vocab
         case 'kana':
-            return '' if not word.japanese[0].word else word.japanese[0].reading
+            return _kana
         case 'translation':
-            if senses == 1 or sense_count == 1:
-                return DEFINITION_SEPARATOR_STR.join(word.senses[0].english_definitions)
-            # one string with <br> separating sense definitions
-            return '<br>'.join([f'({(word.senses.index(line) + 1).__str__()}) '
-                                + DEFINITION_SEPARATOR_STR.join(line.english_definitions)
-                                for line in sublist])
+            return _sense_lines('english_definitions', DEFINITION_SEPARATOR_STR, senses)
         case 'part_of_speech':
-            if senses == 1 or sense_count == 1:
-                return TYPE_SEPARATOR_STR.join(word.senses[0].parts_of_speech)
-            # one string with <br> separating parts of speech, corresponding to sense definitions
-            return '<br>'.join([f'({(word.senses.index(line) + 1).__str__()}) '
-                                + TYPE_SEPARATOR_STR.join(line.parts_of_speech)
-                                for line in sublist])
+            return _sense_lines('parts_of_speech', TYPE_SEPARATOR_STR, senses)
         case 'jlpt_level':
-            if word.jlpt.__len__() > 0:
-                return word.jlpt[0][-2:].upper()
+            return _jlpt_level
         case 'tags':
-            return ' '.join(word.tags)
+            return _tags
         case 'example':
-            return '' if not example else f'{example.japanese}<br>{example.en_translation}'
+            return _example
         case _:
             raise ValueError(f'Field {field} not in {Config.HeaderConfig.VALID_FIELDS}')
 
 
+def compile_fields(config: Config) -> tuple[Callable[[WordConfig, SentenceConfig], str], ...]:
+    """Extractors for each of the configured header fields, in order. Compile once, then apply to every card."""
+    return tuple(compile_field(f, config.senses) for f in config.header.fields)
+
+
+def get_field(word: WordConfig, field: str, senses: int, example: SentenceConfig = None) -> str:
+    """Returns the correct field value for the supplied word."""
+    return compile_field(field, senses)(word, example)
+
+
 def csv_header(config: Config) -> str:  # Anki header data
     """Returns a `#key:value` formatted Anki file header based on configured values."""
     header_data = {}
@@ -74,9 +114,149 @@ def word_to_csv(item: WordConfig, config: Config, example: SentenceConfig = None
     """Converts a word into a CSV row for an Anki card."""
     out = io.StringIO()  # StringIO not str, for csv writer
     writer = csv.writer(out, dialect='unix')
-    fields = []
-    for f in config.header.fields:
-        fields.append(get_field(item, f, config.senses, example))
-    writer.writerow(fields)
+    writer.writerow([extract(item, example) for extract in compile_fields(config)])
     out.seek(0)
     return out.read()
+
+
+def row_renderer(config: Config, examples: dict[str, SentenceConfig]) -> Callable[[WordConfig], str]:
+    """Returns a function which renders a card as a line of CSV, with its example if it has one."""
+    extractors = compile_fields(config)
+    out = io.StringIO()
+    writer = csv.writer(out, dialect='unix')
+
+    def render(card: WordConfig) -> str:
+        out.seek(0)
+        out.truncate()
+        example = examples.get(card.slug)
+        writer.writerow([extract(card, example) for extract in extractors])
+        return out.getvalue()
+    return profiling.timed('render', render)
+
+
+# renderer of each export worker process, set up once when the process starts
+_worker_render: Callable[[WordConfig], str] | None = None
+
+
+def _init_worker(config: Config, examples: dict[str, SentenceConfig]):
+    global _worker_render
+    _worker_render = row_renderer(config, examples)
+
+
+def _render_in_worker(data: list[str]) -> list[str]:
+    return [_worker_render(Card.from_json(d)) for d in data]
+
+
+@contextmanager
+def data_renderer(config: Config, examples: dict[str, SentenceConfig],
+                  jobs: int = 1) -> Iterator[Callable[[list[str]], list[str]]]:
+    """
+    Provides a function which renders stored card data (see `Card.to_json`) as lines of CSV, a batch at a time.
+    With more than one job, each batch is split between a pool of processes, and the rows put back in order.
+    """
+    if jobs <= 1:
+        render = row_renderer(config, examples)
+        decode = profiling.timed('card decode', Card.from_json)
+        yield lambda batch: [render(decode(d)) for d in batch]
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(jobs, initializer=_init_worker, initargs=(config, examples)) as pool:
+        def render_split(batch: list[str]) -> list[str]:
+            size = -(-len(batch) // jobs)
+            chunks = [batch[i:i + size] for i in range(0, len(batch), size)]
+            with profiling.stage('render (processes)'):
+                return [row for rows in pool.map(_render_in_worker, chunks) for row in rows]
+        yield render_split
+
+
+def split_path(path: str, part: str) -> str:
+    """Path of one part of a split export, e.g. out-n5.csv for out.csv (or out-n5.csv.gz for out.csv.gz)."""
+    path = Path(path)
+    suffixes = ''.join(path.suffixes[-2:] if path.suffix == '.gz' else path.suffixes[-1:])
+    stem = path.name[:len(path.name) - len(suffixes)] if suffixes else path.name
+    return str(path.with_name(f'{stem}-{part}{suffixes}'))
+
+
+def open_output(path: str, compress: bool = False) -> TextIO:
+    """Opens a file to export to. `-` is stdout; gzip compression is used if asked for, or the path ends in .gz."""
+    if path == '-':
+        return sys.stdout
+    if compress or path.endswith('.gz'):
+        return gzip.open(path, 'wt', encoding='utf-8', newline='')
+    return open(path, 'w', encoding='utf-8', newline='')
+
+
+# formats `library export` can write: CSV rows for Anki, or columns for analysing the library
+FORMATS = ['csv', 'parquet', 'npz']
+
+
+def card_columns(cards: Iterable[WordConfig], config: Config,
+                 examples: dict[str, SentenceConfig]) -> dict[str, list]:
+    """
+    The cards as columns rather than rows: the slug and the configured header fields (rendered as for CSV),
+    then each sense's definitions and parts of speech, the JLPT levels and the tags as lists.
+    """
+    extractors = compile_fields(config)
+    fields = [[] for _ in extractors]
+    slugs, definitions, parts_of_speech, jlpt, tags = [], [], [], [], []
+    for card in cards:
+        example = examples.get(card.slug)
+        for column, extract in zip(fields, extractors):
+            column.append(extract(card, example))
+        slugs.append(card.slug)
+        definitions.append([list(s.english_definitions) for s in card.senses])
+        parts_of_speech.append([list(s.parts_of_speech) for s in card.senses])
+        jlpt.append(list(card.jlpt))
+        tags.append(list(card.tags))
+    return {'slug': slugs, **dict(zip(config.header.fields, fields)),
+            'sense_definitions': definitions, 'sense_parts_of_speech': parts_of_speech, 'jlpt': jlpt, 'tags': tags}
+
+
+def write_parquet(path: str, columns: dict[str, list]):
+    """Write columns to a Parquet file, with dictionary encoded strings (needs pyarrow)."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    table = pa.table({name: pa.array(values) for name, values in columns.items()})
+    # top level strings are dictionary encoded in memory too, so readers get them back that way
+    table = pa.table({name: column.dictionary_encode() if pa.types.is_string(column.type) else column
+                      for name, column in zip(table.column_names, table.columns)})
+    pq.write_table(table, path, compression='zstd')
+
+
+def _npz_arrays(name: str, values: list) -> dict:
+    """
+    A column as NumPy arrays: strings as int32 `codes` into the distinct `values` (-1 for missing),
+    and lists flattened like Arrow's, with `offsets.0` into the next level down, `offsets.1` below that, and so on.
+    """
+    import numpy as np
+    arrays = {}
+    level = 0
+    while any(isinstance(v, list) for v in values):
+        lengths = [len(v) for v in values]
+        arrays[f'{name}.offsets.{level}'] = np.concatenate([[0], np.cumsum(lengths, dtype=np.int64)])
+        values = [item for v in values for item in v]
+        level += 1
+    distinct = {v: i for i, v in enumerate(dict.fromkeys(v for v in values if v is not None))}
+    arrays[f'{name}.codes'] = np.array([-1 if v is None else distinct[v] for v in values], dtype=np.int32)
+    arrays[f'{name}.values'] = np.array(list(distinct), dtype=np.str_)
+    return arrays
+
+
+def write_npz(path: str, columns: dict[str, list]):
+    """Write columns to a compressed .npz file of dictionary encoded arrays (needs numpy)."""
+    import numpy as np
+    arrays = {}
+    for name, values in columns.items():
+        arrays.update(_npz_arrays(name, values))
+    with open(path, 'wb') as file:
+        np.savez_compressed(file, **arrays)
+
+
+def column_writer(export_format: str) -> Callable[[str, dict[str, list]], None]:
+    """The writer for a columnar format. Raises ImportError if the library it needs isn't installed."""
+    if export_format == 'parquet':
+        import pyarrow.parquet
+        return write_parquet
+    import numpy
+    return write_npz
@@ -0,0 +1,144 @@
+import json
+import threading
+import time
+from contextlib import nullcontext
+from typing import Callable, Iterable, TypeVar
+
+F = TypeVar('F', bound=Callable)
+T = TypeVar('T')
+
+
+class Profile:
+    """
+    Time spent in each stage of a run, and counts of what it did (requests, cache hits, bytes, rows...).
+    Stage times are summed over every thread, so concurrent stages like network requests can add up to more than
+    the wall time.
+    """
+
+    def __init__(self):
+        self.stages: dict[str, list] = {}  # stage -> [calls, seconds]
+        self.counters: dict[str, int] = {}
+        self.started = time.perf_counter()
+        self.wall = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float):
+        with self._lock:
+            entry = self.stages.setdefault(stage, [0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+
+    def count(self, counter: str, n: int = 1):
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + n
+
+    def to_dict(self) -> dict:
+        return {
+            'wall_seconds': round(self.wall, 6),
+            'stages': {stage: {'calls': calls, 'seconds': round(seconds, 6)}
+                       for stage, (calls, seconds) in sorted(self.stages.items(), key=lambda s: -s[1][1])},
+            'counters': dict(sorted(self.counters.items())),
+        }
+
+    def report(self) -> str:
+        lines = [f'{"stage":24} {"calls":>9} {"ms":>10}']
+        lines += [f'{stage:24} {calls:9} {seconds * 1000:10.1f}'
+                  for stage, (calls, seconds) in sorted(self.stages.items(), key=lambda s: -s[1][1])]
+        if self.counters:
+            lines.append(f'{"counter":24} {"count":>9}')
+        lines += [f'{counter:24} {n:9}' for counter, n in sorted(self.counters.items())]
+        lines.append(f'{"wall time":24} {"":9} {self.wall * 1000:10.1f}')
+        return '\n'.join(lines)
+
+
+# the profile of the running command, if it's being profiled
+current: Profile | None = None
+
+
+class _Stage:
+    def __init__(self, profile: Profile, stage: str):
+        self.profile = profile
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.profile.add(self.stage, time.perf_counter() - self.start)
+
+
+_NOT_PROFILING = nullcontext()
+
+
+def stage(name: str):
+    """Context manager adding the time spent in it to a stage. Does nothing unless profiling."""
+    return _NOT_PROFILING if current is None else _Stage(current, name)
+
+
+def count(counter: str, n: int = 1):
+    if current is not None:
+        current.count(counter, n)
+
+
+def timed(name: str, f: F) -> F:
+    """
+    A version of the function which adds the time of each call to a stage. When not profiling, the function itself.
+    For hot loops: wrap the function once, before the loop.
+    """
+    profile = current
+    if profile is None:
+        return f
+
+    def timed_call(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return f(*args, **kwargs)
+        finally:
+            profile.add(name, time.perf_counter() - start)
+    return timed_call
+
+
+def written(items: Iterable[T], counter: str, text: Callable[[T], str] = None) -> Iterable[T]:
+    """
+    Items about to be written, counted under `counter`, and the bytes of their `text` (the items themselves
+    by default) as bytes written. When not profiling, the same items.
+    """
+    profile = current
+    if profile is None:
+        return items
+
+    def count_each():
+        for item in items:
+            profile.count(counter)
+            profile.count('bytes written', len((text(item) if text else item).encode()))
+            yield item
+    return count_each()
+
+
+def start(cprofile_path: str = None) -> Callable[[], Profile]:
+    """
+    Start profiling, and optionally also run cProfile (on the calling thread only).
+    Returns a function which stops profiling, writes the cProfile stats and returns the profile.
+    """
+    global current
+    current = Profile()
+    profiler = None
+    if cprofile_path:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    def stop() -> Profile:
+        global current
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(cprofile_path)
+        profile, current = current, None
+        profile.wall = time.perf_counter() - profile.started
+        return profile
+    return stop
+
+
+def write_json(profile: Profile, path: str):
+    with open(path, 'w') as file:
+        json.dump(profile.to_dict(), file, indent=2)
@@ -0,0 +1,211 @@
+import threading
+import time
+import unicodedata
+from typing import Any, Callable, Iterable, Iterator
+
+import profiling
+
+JISHO_HOST = 'jisho.org'
+
+DEFAULT_WORKERS = 4
+DEFAULT_RATE = 4.0  # requests started per second, per host
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 0.5  # seconds, doubled after every failed attempt
+
+
+def normalize(query: str) -> str:
+    """
+    The form of a query that's sent to jisho.org, so that queries which only differ in how they're typed share a request.
+    Full-width letters and digits and half-width kana become their usual widths, kana with separate voicing marks
+    are combined (NFKC), and whitespace (including Japanese full-width spaces) is collapsed to single spaces.
+    """
+    return ' '.join(unicodedata.normalize('NFKC', query).split())
+
+
+def split_words(words: Iterable[str]) -> list[str]:
+    """Normalized words, splitting any separated by (Japanese or ASCII) whitespace."""
+    return [w for word in words for w in normalize(word).split()]
+
+
+class RateLimiter:
+    """Spaces out requests so that no more than `rate` of them are started per second for each host."""
+
+    def __init__(self, rate: float = DEFAULT_RATE):
+        self.interval = 1 / rate if rate > 0 else 0
+        self._next: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def wait(self, host: str):
+        if not self.interval:
+            return
+        # reserve the next free slot for this host, then sleep outside the lock until it comes around
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next.get(host, now))
+            self._next[host] = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+class Result:
+    """Outcome of a single request. `value` is None if nothing was found, `error` is set if the request failed."""
+
+    def __init__(self, query: str, value: Any = None, error: Exception = None):
+        self.query = query
+        self.value = value
+        self.error = error
+
+    @property
+    def found(self) -> bool:
+        return self.error is None and self.value is not None
+
+
+class Fetcher:
+    """
+    Runs requests on a pool of worker threads, with a per-host rate limit and retries with exponential backoff.
+    Queries are normalized, and each distinct one among those given together is only requested once;
+    `saved` counts the requests this saved.
+    """
+
+    def __init__(self, workers: int = DEFAULT_WORKERS, rate: float = DEFAULT_RATE,
+                 retries: int = DEFAULT_RETRIES, backoff: float = DEFAULT_BACKOFF):
+        self.workers = max(1, workers)
+        self.retries = max(0, retries)
+        self.backoff = backoff
+        self.limiter = RateLimiter(rate)
+        self.saved = 0
+
+    def _distinct(self, queries: list[str]) -> tuple[list[str], list[str]]:
+        """The normalized form of each query, and each of those once."""
+        keys = [normalize(q) for q in queries]
+        distinct = list(dict.fromkeys(keys))
+        if len(distinct) < len(keys):
+            self.saved += len(keys) - len(distinct)
+            profiling.count('requests saved', len(keys) - len(distinct))
+        return keys, distinct
+
+    def limited(self, request: Callable[[str], Any], host: str = JISHO_HOST) -> Callable[[str], Any]:
+        """
+        Returns a version of the request function which waits its turn under the rate limit.
+        Wrap only the network call, so that cached responses aren't held up.
+        """
+        def wait_then_request(query: str):
+            with profiling.stage('rate limit wait'):
+                self.limiter.wait(host)
+            profiling.count('requests')
+            with profiling.stage('network'):
+                return request(query)
+        return wait_then_request
+
+    def fetch(self, request: Callable[[str], Any], query: str) -> Result:
+        """
+        Make a single request, retrying on network errors and responses saying to try again later.
+        Any other error is returned in the result, so that one bad response doesn't stop the other queries.
+        """
+        import requests
+        attempt = 0
+        while True:
+            try:
+                return Result(query, request(query))
+            except requests.RequestException as e:
+                if attempt >= self.retries or not _is_transient(e):
+                    return Result(query, error=e)
+            except Exception as e:  # e.g. a cache miss, or a response that doesn't parse
+                return Result(query, error=e)
+            time.sleep(self.backoff * 2 ** attempt)
+            attempt += 1
+
+    def stream(self, request: Callable[[str], Any], queries: Iterable[str]) -> Iterator[Result]:
+        """
+        Start every request in the background straight away, and yield the results in order of the queries.
+        Lets the caller work through earlier results (e.g. prompting the user) while later ones are still coming in.
+        """
+        queries = list(queries)
+        if not queries:
+            return
+        keys, distinct = self._distinct(queries)
+        from concurrent.futures import ThreadPoolExecutor
+        pool = ThreadPoolExecutor(max_workers=min(self.workers, len(distinct)))
+        try:
+            futures = {key: pool.submit(self.fetch, request, key) for key in distinct}
+            for query, key in zip(queries, keys):
+                yield _for_query(futures[key].result(), query)
+        finally:
+            # if the caller stops early, don't wait for requests that haven't started
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def map(self, request: Callable[[str], Any], queries: Iterable[str]) -> list[Result]:
+        """Make a request for each query concurrently. Results are returned in the same order as the queries."""
+        queries = list(queries)
+        keys, distinct = self._distinct(queries)
+        if len(distinct) <= 1 or self.workers == 1:
+            results = [self.fetch(request, key) for key in distinct]
+        else:
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(distinct))) as pool:
+                results = list(pool.map(lambda key: self.fetch(request, key), distinct))
+        results = dict(zip(distinct, results))
+        return [_for_query(results[key], query) for query, key in zip(queries, keys)]
+
+
+def _is_transient(error) -> bool:
+    """
+    Whether a failed request is worth trying again: a network error, or the server being busy or overloaded.
+    Error pages in place of JSON (no response attached) count as the latter.
+    """
+    response = getattr(error, 'response', None)
+    return response is None or response.status_code == 429 or response.status_code >= 500
+
+
+def _for_query(result: Result, query: str) -> Result:
+    """A result shared between queries, as the result for one of them as it was given."""
+    return result if result.query == query else Result(query, result.value, result.error)
+
+
+def request_word(word: str):
+    """
+    Same as `Word.request`, but raises for error responses (e.g. 503 pages while jisho.org is overloaded),
+    so that they're retried or reported rather than cached as there being no matches.
+    """
+    from urllib.parse import quote
+    import requests
+    from jisho_api.word import Word
+    from jisho_api.word.request import WordRequest
+
+    response = requests.get(Word.URL + quote(word))
+    response.raise_for_status()
+    result = WordRequest(**response.json())
+    return result if len(result) else None
+
+
+def request_tokens(text: str):
+    """Same as `Tokens.request`, but raises for error responses, like `request_word`."""
+    from urllib.parse import quote
+    import requests
+    from bs4 import BeautifulSoup
+    from jisho_api.tokenize import Tokens
+    from jisho_api.tokenize.request import TokenRequest
+
+    response = requests.get(Tokens.URL + quote(text))
+    response.raise_for_status()
+    data = Tokens.tokens(BeautifulSoup(response.content, 'html.parser'))
+    return TokenRequest(meta={'status': 200}, data=data) if data else None
+
+
+def request_sentences(word: str):
+    """
+    Same as `Sentence.request`, but only builds the parse tree for the sentences themselves,
+    rather than the whole search results page.
+    """
+    from urllib.parse import quote
+    import requests
+    from bs4 import BeautifulSoup, SoupStrainer
+    from jisho_api.sentence import Sentence
+    from jisho_api.sentence.request import SentenceRequest
+
+    response = requests.get(Sentence.URL + quote(word + ' #sentences'))
+    # otherwise an error page would be cached as there being no sentences
+    response.raise_for_status()
+    soup = BeautifulSoup(response.content, 'html.parser', parse_only=SoupStrainer('div', class_='sentence_content'))
+    data = Sentence.sentences(soup)
+    return SentenceRequest(meta={'status': 200}, data=data) if data else None
@@ -0,0 +1,245 @@
+"""
+`serve` keeps a process running in the background, which runs the commands for thin clients over a Unix socket.
+Imports, examples and config then stay loaded between commands, so each one starts in milliseconds.
+
+Messages are lines of JSON. The client sends the command it was started as, its arguments and working directory;
+the server answers with its output ({"out": ...} and {"err": ...}), asks for input ({"input": true}, answered with
+{"line": ...}, empty at the end of input) and finally sends the command's exit code ({"exit": ...}).
+"""
+import io
+import json
+import os
+import socket
+import sys
+from contextlib import redirect_stderr, redirect_stdout
+from typing import Callable
+
+from configuration import CACHE_DIR
+
+SOCKET_PATH = CACHE_DIR / 'serve.sock'
+
+# output is sent to the client in pieces of about this many characters
+_FLUSH_SIZE = 1 << 16
+
+
+def _connect() -> socket.socket | None:
+    """Connect to the server, if one is running."""
+    if not hasattr(socket, 'AF_UNIX') or not SOCKET_PATH.is_socket():
+        return None
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(str(SOCKET_PATH))
+    except OSError:  # left behind by a server which didn't stop cleanly
+        connection.close()
+        return None
+    return connection
+
+
+def forward(command: str, args: list[str]) -> int | None:
+    """Run a command on the server, passing on its output and input. Returns its exit code, or None if not serving."""
+    connection = _connect()
+    if connection is None:
+        return None
+    interactive = sys.stdin.isatty()
+    with connection, connection.makefile('rw', encoding='utf-8', newline='\n') as stream:
+        stream.write(json.dumps({'command': command, 'args': args, 'cwd': os.getcwd()}) + '\n')
+        stream.flush()
+        for line in stream:
+            message = json.loads(line)
+            if 'out' in message:
+                sys.stdout.write(message['out'])
+                sys.stdout.flush()
+            elif 'err' in message:
+                sys.stderr.write(message['err'])
+                sys.stderr.flush()
+            elif 'input' in message:
+                # a line at a time for prompts, but piped input in large pieces
+                text = sys.stdin.readline() if interactive else sys.stdin.read(_FLUSH_SIZE)
+                stream.write(json.dumps({'line': text}) + '\n')
+                stream.flush()
+            elif 'exit' in message:
+                return message['exit']
+    # the server stopped in the middle of the command
+    return 1
+
+
+def client(command: str) -> Callable[[], None]:
+    """Entry point for a command, which runs it on the server if one is running, and in this process otherwise."""
+    def run():
+        code = forward(command, sys.argv[1:])
+        if code is None:
+            import application
+            getattr(application, command)()
+        sys.exit(code)
+    return run
+
+
+word = client('word')
+token = client('token')
+batch = client('batch')
+library = client('library')
+config = client('config')
+
+
+class _Client:
+    """The connection to a client, while running its command."""
+
+    def __init__(self, stream: io.TextIOBase):
+        self.stream = stream
+        self.kind = 'out'
+        self.pending: list[str] = []
+        self.size = 0
+
+    def send(self, **message):
+        self.stream.write(json.dumps(message) + '\n')
+        self.stream.flush()
+
+    def write(self, kind: str, text: str):
+        if kind != self.kind:
+            self.flush()
+            self.kind = kind
+        self.pending.append(text)
+        self.size += len(text)
+        if self.size >= _FLUSH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.send(**{self.kind: ''.join(self.pending)})
+            self.pending.clear()
+            self.size = 0
+
+    def read(self) -> str:
+        self.flush()
+        self.send(input=True)
+        return json.loads(self.stream.readline())['line']
+
+
+class _Output(io.TextIOBase):
+    """Stdout or stderr of a command, sent to the client."""
+    encoding = 'utf-8'
+    errors = 'strict'
+
+    def __init__(self, client: _Client, kind: str):
+        self.client = client
+        self.kind = kind
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, text: str) -> int:
+        if not isinstance(text, str):
+            raise TypeError(f'write() argument must be str, not {type(text).__name__}')
+        self.client.write(self.kind, text)
+        return len(text)
+
+    def flush(self):
+        self.client.flush()
+
+
+class _Input(io.TextIOBase):
+    """Stdin of a command, read from the client."""
+    encoding = 'utf-8'
+    errors = 'strict'
+
+    def __init__(self, client: _Client):
+        self.client = client
+        self.pending = ''
+        self.ended = False
+        self.buffer = _BinaryInput(self)
+
+    def readable(self) -> bool:
+        return True
+
+    def readline(self, size: int = -1) -> str:
+        while '\n' not in self.pending and not self.ended:
+            text = self.client.read()
+            self.ended = not text
+            self.pending += text
+        end = self.pending.find('\n') + 1 or len(self.pending)
+        line, self.pending = self.pending[:end], self.pending[end:]
+        return line
+
+
+class _BinaryInput:
+    """`sys.stdin.buffer`, for commands which read lines of bytes from stdin."""
+
+    def __init__(self, text: _Input):
+        self.text = text
+
+    def __iter__(self):
+        for line in iter(self.text.readline, ''):
+            yield line.encode()
+
+
+def _run(command, name: str, args: list[str]) -> int:
+    import traceback
+    import click
+    try:
+        result = command.main(args, prog_name=name, standalone_mode=False)
+        return result if isinstance(result, int) else 0
+    except click.ClickException as e:
+        e.show(file=sys.stderr)
+        return e.exit_code
+    except click.Abort:
+        click.echo('Aborted!', err=True)
+        return 1
+    except Exception:
+        traceback.print_exc()
+        return 1
+
+
+def _handle(connection: socket.socket, commands: dict):
+    with connection, connection.makefile('rw', encoding='utf-8', newline='\n') as stream:
+        request = json.loads(stream.readline())
+        client = _Client(stream)
+        stdin, cwd = sys.stdin, os.getcwd()
+        sys.stdin = _Input(client)
+        try:
+            os.chdir(request['cwd'])
+            with redirect_stdout(_Output(client, 'out')), redirect_stderr(_Output(client, 'err')):
+                code = _run(commands[request['command']], request['command'], request['args'])
+            client.flush()
+        finally:
+            sys.stdin = stdin
+            os.chdir(cwd)
+        client.send(exit=code)
+
+
+def serve(commands: dict):
+    """Run commands for clients, one at a time, until interrupted."""
+    import signal
+    import click
+    import configuration
+
+    if not hasattr(socket, 'AF_UNIX'):
+        raise click.ClickException('Serving needs Unix sockets, which this system doesn\'t have.')
+    connection = _connect()
+    if connection is not None:
+        connection.close()
+        raise click.ClickException(f'Already serving on {SOCKET_PATH}.')
+
+    configuration.keep_warm = True
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    SOCKET_PATH.unlink(missing_ok=True)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # only this user can connect
+    umask = os.umask(0o177)
+    try:
+        server.bind(str(SOCKET_PATH))
+    finally:
+        os.umask(umask)
+    server.listen()
+    # stop cleanly when killed, too
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    click.echo(f'Serving on {SOCKET_PATH}. Stop with Ctrl+C.')
+    try:
+        while True:
+            connection, _ = server.accept()
+            try:
+                _handle(connection, commands)
+            except (OSError, ValueError, KeyError) as e:  # the client went away, or sent something unreadable
+                click.echo(f'Dropped a client: {e}', err=True)
+    finally:
+        server.close()
+        SOCKET_PATH.unlink(missing_ok=True)
@@ -3,18 +3,26 @@ from setuptools import setup
 setup(
     name='jisho-nomikomi',
     version='0.1.0',
-    py_modules=['application', 'formatting', 'configuration'],
+    py_modules=['application', 'formatting', 'configuration', 'requesting', 'caching', 'cards', 'profiling',
+                'tokenizing', 'serving'],
     install_requires=[
         'Click', 'jisho-api', 'jsonpickle'
     ],
+    # only needed for columnar exports (`library export -f parquet` / `-f npz`)
+    extras_require={
+        'parquet': ['pyarrow'],
+        'npz': ['numpy'],
+    },
     entry_points={
         'console_scripts': [
-            'word = application:word',
-            'words = application:word',
-            'token = application:token',
-            'tokens = application:token',
-            'library = application:library',
-            'config = application:config',
+            'word = serving:word',
+            'words = serving:word',
+            'token = serving:token',
+            'tokens = serving:token',
+            'batch = serving:batch',
+            'library = serving:library',
+            'config = serving:config',
+            'serve = application:serve',
         ],
     },
 )
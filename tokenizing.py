@@ -0,0 +1,79 @@
+import re
+from typing import Callable, Iterable
+
+# a tokenizer takes a text, and returns its tokens (None if there weren't any)
+Tokenizer = Callable[[str], list[str] | None]
+
+TOKENIZERS = ['jisho', 'local']
+
+# where a text can be split between chunks, keeping the punctuation with the sentence before it
+_SENTENCE_END = re.compile(r'(?<=[。．！？!?\n])')
+
+
+def split_text(text: str, size: int) -> list[str]:
+    """
+    Split a text into chunks of at most `size` characters, at the ends of sentences where possible,
+    so that each can be tokenized separately.
+    """
+    chunks, chunk = [], ''
+    for sentence in _SENTENCE_END.split(text):
+        if chunk and len(chunk) + len(sentence) > size:
+            chunks.append(chunk)
+            chunk = ''
+        chunk += sentence
+        while len(chunk) > size:
+            chunks.append(chunk[:size])
+            chunk = chunk[size:]
+    if chunk.strip():
+        chunks.append(chunk)
+    return chunks
+
+
+def _script(c: str) -> str:
+    """Which kind of character this is, for grouping unknown characters into tokens."""
+    if '぀' <= c <= 'ゟ':
+        return 'hiragana'
+    if '゠' <= c <= 'ヿ':
+        return 'katakana'
+    if '一' <= c <= '鿿' or c == '々':
+        return 'kanji'
+    if c.isalnum():
+        return 'latin'
+    return ''  # whitespace, punctuation...
+
+
+class DictionaryTokenizer:
+    """
+    Splits text into the longest known words it can, e.g. the written forms and readings of the cards in the library.
+    Runs of unknown characters are kept together as tokens while they're in the same script.
+    Works offline, but is much cruder than jisho.org's tokenizer: it knows nothing about grammar or inflection.
+    """
+
+    def __init__(self, words: Iterable[str]):
+        self.words = {w for w in words if w}
+        self.longest = max(map(len, self.words), default=0)
+
+    def __call__(self, text: str) -> list[str] | None:
+        tokens = []
+        unknown = ''
+        i = 0
+        while i < len(text):
+            match = next((text[i:i + n] for n in range(min(self.longest, len(text) - i), 0, -1)
+                          if text[i:i + n] in self.words), None)
+            if match is None and unknown and _script(text[i]) == _script(unknown[-1]):
+                unknown += text[i]
+                i += 1
+                continue
+            if unknown:
+                tokens.append(unknown)
+                unknown = ''
+            if match is not None:
+                tokens.append(match)
+                i += len(match)
+            else:
+                if _script(text[i]):
+                    unknown = text[i]
+                i += 1
+        if unknown:
+            tokens.append(unknown)
+        return tokens or None